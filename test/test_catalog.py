@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xc2.catalog import MediaCatalog
+
+
+class MediaCatalogTest(unittest.TestCase):
+    FILES = [
+        'xc_p/m1/SetA-2P0V-p1/1.jpg',
+        'xc_p/m1/SetA-2P0V-p1/2.jpg',
+        'xc_p/m1/SetB-2P0V-p2/1.jpg',
+        'xc_p/m1/SetC-2P0V-p3/1.jpg',
+        'xc_p/m1/SetC-2P0V-p3/2.jpg.part',
+        'xc_p/m1/SetD-p4/1.jpg',
+        'xc_v/up1/title-v1.mp4',
+        'xc_v/up1/title-v2.mp4',
+        'xc_v/up1/title-v2.f137.mp4.part',
+        'xc_v/up1/title-v3.mp4.ytdl',
+        'xbbs/Thread 1/01-t1.jpg',
+        'xbbs/Thread 1/02-t1.jpg',
+        'xbbs/Thread 2/1-t2.jpg',
+        'xbbs/Thread 2/3-t2.jpg',
+    ]
+
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        self.work_dir = tempfile.mkdtemp()
+        for file in self.FILES:
+            path = os.path.join(self.work_dir, file)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(b'x' * 10)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.catalog = MediaCatalog(self.conf_dir, self.work_dir).refresh()
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir)
+        shutil.rmtree(self.work_dir)
+
+    def test_parse_partial_id(self):
+        self.assertEqual(MediaCatalog.parse_partial_id('title-v2.f137.mp4.part'), 'v2')
+        self.assertEqual(MediaCatalog.parse_partial_id('title-v3.mp4.ytdl'), 'v3')
+
+    def test_photo_sets(self):
+        self.assertTrue(self.catalog.is_satisfied('xc_p', 'p1'))
+        # one missing photo is tolerated, like scan
+        self.assertTrue(self.catalog.is_satisfied('xc_p', 'p2'))
+        self.assertFalse(self.catalog.is_satisfied('xc_p', 'p3'))
+        # no NPnV in the name, nothing to prove
+        self.assertFalse(self.catalog.is_satisfied('xc_p', 'p4'))
+
+    def test_videos_per_file(self):
+        self.assertTrue(self.catalog.is_satisfied('xc_v', 'v1'))
+        self.assertFalse(self.catalog.is_satisfied('xc_v', 'v2'))
+        self.assertFalse(self.catalog.is_satisfied('xc_v', 'v3'))
+
+    def test_threads(self):
+        self.assertTrue(self.catalog.is_satisfied('xbbs', 't1'))
+        self.assertFalse(self.catalog.is_satisfied('xbbs', 't2'))
+        self.assertFalse(self.catalog.is_satisfied('xbbs', 'missing'))
+
+
+if __name__ == '__main__':
+    unittest.main()
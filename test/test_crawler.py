@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import re
+import sys
+import threading
+import unittest
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xc2.crawler import ListCrawler
+
+FIXTURE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'fixtures', 'crawler')
+
+
+class FixtureHandler(http.server.BaseHTTPRequestHandler):
+    # series-1: 3 pages, the site repeats the last one past the end
+    # series-2: 1 page, 404 past the end
+    # broken: a page without a list container
+    PATH_PATTERN = re.compile(r'^/photos/([\w-]+)/(\d+)\.html$')
+
+    def fixture(self):
+        match = self.PATH_PATTERN.match(self.path)
+        if not match:
+            return None
+        name, page = match.group(1), int(match.group(2))
+        if name == 'series-1':
+            return f'series_{min(page, 3)}.html'
+        if name == 'series-2' and page == 1:
+            return 'series_1.html'
+        if name == 'broken':
+            return 'no_list.html'
+        return None
+
+    def do_GET(self):
+        self.server.paths.append(self.path)
+        fixture = self.fixture()
+        if fixture is None:
+            self.send_response(404)
+            self.end_headers()
+            return
+        with open(os.path.join(FIXTURE_DIR, fixture), 'rb') as f:
+            body = f.read()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/html; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class ListCrawlerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), FixtureHandler)
+        cls.server.paths = []
+        cls.thread = threading.Thread(target=cls.server.serve_forever, daemon=True)
+        cls.thread.start()
+        cls.root = f'http://127.0.0.1:{cls.server.server_address[1]}'
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def crawl(self, name, archived=(), early_stop=False, workers=2):
+        crawler = ListCrawler(workers, timeout=5)
+        return crawler.crawl('xc_p', f'{self.root}/photos/{name}/%d.html',
+                             lambda item_id: item_id in archived, early_stop=early_stop)
+
+    def test_extract_ids_skips_sidebar(self):
+        with open(os.path.join(FIXTURE_DIR, 'series_1.html'), encoding='utf-8') as f:
+            text = f.read()
+        self.assertEqual(ListCrawler.extract_ids('xc_p', text), ['a0001', 'a0002', 'a0003'])
+
+    def test_extract_ids_without_container(self):
+        with open(os.path.join(FIXTURE_DIR, 'no_list.html'), encoding='utf-8') as f:
+            text = f.read()
+        self.assertIsNone(ListCrawler.extract_ids('xc_p', text))
+
+    def test_stops_at_repeated_last_page(self):
+        ids = self.crawl('series-1')
+        self.assertEqual(ids, ['a0001', 'a0002', 'a0003', 'a0004', 'a0005', 'a0006', 'a0007'])
+
+    def test_stops_at_404(self):
+        self.assertEqual(self.crawl('series-2'), ['a0001', 'a0002', 'a0003'])
+
+    def test_early_stop_on_archived_page(self):
+        ids = self.crawl('series-1', archived={'a0004', 'a0005', 'a0006'}, early_stop=True, workers=1)
+        self.assertEqual(ids, ['a0001', 'a0002', 'a0003'])
+
+    def test_unknown_layout_raises(self):
+        with self.assertRaises(ValueError):
+            self.crawl('broken')
+
+
+if __name__ == '__main__':
+    unittest.main()
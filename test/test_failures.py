@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import io
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+import contextlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xc2.failures import FailureJournal
+from xc2.xchina2 import XchinaSession, PlaylistArchiveHandler
+
+
+class FailureJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        self.journal = FailureJournal(self.conf_dir)
+
+    def tearDown(self):
+        shutil.rmtree(self.conf_dir)
+
+    def test_classify(self):
+        self.assertEqual(FailureJournal.classify('ERROR: Unsupported URL: https://x'), ('unsupported', None))
+        self.assertEqual(FailureJournal.classify('ERROR: HTTP Error 404: Not Found'), ('http', 404))
+        self.assertEqual(FailureJournal.classify('ERROR: <urlopen error timed out>'), ('timeout', None))
+        self.assertEqual(FailureJournal.classify('ERROR: Unable to extract title'), ('extractor', None))
+        self.assertEqual(FailureJournal.classify('Killed'), ('unknown', None))
+
+    def test_is_permanent(self):
+        self.assertTrue(FailureJournal.is_permanent('unsupported'))
+        self.assertTrue(FailureJournal.is_permanent('http', 404))
+        self.assertFalse(FailureJournal.is_permanent('http', 429))
+        self.assertFalse(FailureJournal.is_permanent('http', 503))
+        self.assertFalse(FailureJournal.is_permanent('timeout'))
+
+    def test_backoff(self):
+        self.assertEqual(FailureJournal.backoff(1), FailureJournal.BACKOFF_BASE)
+        self.assertEqual(FailureJournal.backoff(3), FailureJournal.BACKOFF_BASE * 4)
+        self.assertEqual(FailureJournal.backoff(100), FailureJournal.BACKOFF_MAX)
+
+    def test_record_parks_permanent_and_exhausted(self):
+        entry = self.journal.record('xc_p', 'a', 'http', 404, now=0)
+        self.assertEqual(entry['status'], FailureJournal.STATUS_PARKED)
+        for attempt in range(FailureJournal.MAX_ATTEMPTS):
+            entry = self.journal.record('xc_p', 'b', 'http', 500, now=attempt)
+        self.assertEqual(entry['status'], FailureJournal.STATUS_PARKED)
+
+    def test_eligible_then_dispatch(self):
+        self.journal.record('xc_p', 'a', 'http', 500, now=0)
+        self.assertEqual(self.journal.eligible(now=1), [])
+        eligible = self.journal.eligible(now=FailureJournal.BACKOFF_BASE)
+        self.assertEqual([entry['url'] for entry in eligible], ['a'])
+        # planning alone leaves it pending
+        self.assertEqual(self.journal.entries()['a']['status'], FailureJournal.STATUS_PENDING)
+        self.journal.dispatch(['a'], now=FailureJournal.BACKOFF_BASE)
+        self.assertEqual(self.journal.entries()['a']['status'], FailureJournal.STATUS_DISPATCHED)
+        self.assertEqual(self.journal.eligible(now=FailureJournal.BACKOFF_BASE + FailureJournal.DISPATCHED_TTL + 1), [])
+        self.assertEqual(self.journal.entries(), {})
+
+    def test_keeps_first_sync_mode(self):
+        self.journal.record('xc_p', 'a', 'http', 500, recent_only=True)
+        self.journal.record('xc_p', 'a', 'http', 500, recent_only=False)
+        self.assertTrue(self.journal.entries()['a']['recent_only'])
+
+
+class ArchivedFailuresTest(unittest.TestCase):
+    def setUp(self):
+        self.root_dir = tempfile.mkdtemp()
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.session = XchinaSession(self.root_dir, self.root_dir, use_catalog=False)
+        # playlist entries are archived as "<extractor> <id>_<n>"
+        with open(PlaylistArchiveHandler.get_source_archive_path(self.session.conf_dir, 'xc_p'), 'w') as f:
+            f.write('xchinaphoto 111_1\nxchinaphoto 111_2\nxchinaphoto 222\n')
+        with open(PlaylistArchiveHandler.get_source_archive_path(self.session.conf_dir, 'xbbs'), 'w') as f:
+            f.write('xbbsthread 333_1\n')
+
+    def tearDown(self):
+        shutil.rmtree(self.root_dir)
+
+    def test_parse_archive_id(self):
+        self.assertEqual(PlaylistArchiveHandler.parse_archive_id('xchinaphoto 111_1\n', 'xchinaphoto'), '111')
+        self.assertEqual(PlaylistArchiveHandler.parse_archive_id('xchinaphoto 222', 'xchinaphoto'), '222')
+        self.assertIsNone(PlaylistArchiveHandler.parse_archive_id('xchinavideo 222', 'xchinaphoto'))
+
+    def test_get_archived_urls(self):
+        urls = ['https://xchina.co/photo/id-111.html', 'https://xchina.co/photo/id-222.html',
+                'https://xchina.co/photo/id-444.html', 'https://xchina.co/photos/series-1.html']
+        self.assertEqual(self.session.get_archived_urls('xc_p', urls), set(urls[:2]))
+        self.assertEqual(self.session.get_archived_urls('xbbs', ['https://xbbs.me/thread/id-333.html']),
+                         {'https://xbbs.me/thread/id-333.html'})
+        self.assertEqual(self.session.get_archived_urls(None, urls), set())
+
+    def test_resolve_archived_failures(self):
+        journal = FailureJournal(self.session.conf_dir)
+        journal.record('xc_p', 'https://xchina.co/photo/id-111.html', 'http', 500)
+        journal.record('xc_p', 'https://xchina.co/photo/id-444.html', 'http', 500)
+        with contextlib.redirect_stdout(io.StringIO()):
+            self.session.resolve_archived_failures()
+        self.assertEqual(list(journal.entries().keys()), ['https://xchina.co/photo/id-444.html'])
+
+
+if __name__ == '__main__':
+    unittest.main()
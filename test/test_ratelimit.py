@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import threading
+import unittest
+import urllib.error
+import http.server
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xc2.ratelimit import HostRateLimiter
+from xc2.crawler import ListCrawler
+
+
+class ThrottlingHandler(http.server.BaseHTTPRequestHandler):
+    # stand-in for a site answering 429 to requests closer than min_interval,
+    # off the 5/s the limiter settles at so arrival jitter can't trip it
+    min_interval = 0.15
+
+    def do_GET(self):
+        server = self.server
+        with server.lock:
+            now = time.time()
+            throttled = now - server.last_ok < self.min_interval
+            if not throttled:
+                server.last_ok = now
+            server.hits.append((now, throttled))
+        if throttled:
+            self.send_response(429)
+            self.end_headers()
+            return
+        body = b'<a href="/photo/id-abc.html">x</a>'
+        self.send_response(200)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class HostRateLimiterTest(unittest.TestCase):
+    def setUp(self):
+        self.conf_dir = tempfile.mkdtemp()
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0), ThrottlingHandler)
+        self.server.lock = threading.Lock()
+        self.server.last_ok = 0.0
+        self.server.hits = []
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        self.url = f'http://127.0.0.1:{self.server.server_address[1]}/photos/1.html'
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.conf_dir)
+
+    def fetch_all(self, limiter, count):
+        crawler = ListCrawler(1, limiter)
+        ok = 0
+        for _ in range(count):
+            try:
+                crawler.fetch(self.url)
+                ok += 1
+            except urllib.error.HTTPError as e:
+                self.assertEqual(e.code, 429)
+        return ok
+
+    def test_backs_off_until_not_throttled(self):
+        limiter = HostRateLimiter(self.conf_dir, rate=20, burst=1, recover=0)
+        self.fetch_all(limiter, 12)
+        host = self.url[:self.url.find('/photos/')+1]
+        rate = limiter.report(host)
+        self.assertLessEqual(rate, 1.0 / ThrottlingHandler.min_interval)
+        # once backed off, the tail of the run is no longer throttled
+        self.assertTrue(any(throttled for _, throttled in self.server.hits))
+        self.assertFalse(any(throttled for _, throttled in self.server.hits[-4:]))
+
+    def test_spaces_requests(self):
+        limiter = HostRateLimiter(self.conf_dir, rate=4, burst=1)
+        ok = self.fetch_all(limiter, 4)
+        self.assertEqual(ok, 4)
+        times = [ts for ts, _ in self.server.hits]
+        self.assertGreaterEqual(times[-1] - times[0], 3 * 0.25 - 0.05)
+
+    def test_zero_rate_is_unlimited(self):
+        limiter = HostRateLimiter(self.conf_dir, rate=0)
+        self.assertEqual(limiter.acquire('http://127.0.0.1/'), 0.0)
+        self.assertIsNone(HostRateLimiter.sleep_interval(0))
+        self.fetch_all(limiter, 3)
+        self.assertEqual(len(self.server.hits), 3)
+
+    def test_sleep_interval_per_process(self):
+        self.assertEqual(HostRateLimiter.sleep_interval(2), 0.5)
+        # 4 processes at 2/s together
+        self.assertEqual(HostRateLimiter.sleep_interval(2, 4), 2.0)
+
+    def test_throttle_from_output(self):
+        self.assertTrue(HostRateLimiter.is_throttled('ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests'))
+        self.assertFalse(HostRateLimiter.is_throttled('ERROR: Unable to download webpage: HTTP Error 404: Not Found'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import sys
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+import tempfile
+
+from .utils import iter_sorted_unique
+
+
+class ArchiveIndex(object):
+    # Sorted array of 64-bit id keys behind a small header, queried in place
+    # through mmap with a binary search, so membership needs no parsing.
+    MAGIC = b'XC2AIDX1'
+    HEADER = struct.Struct('<8sQ')
+    WRITE_CHUNK = 65536
+
+    def __init__(self, path):
+        self.path = path
+        self.f = None
+        self.mm = None
+        self.keys = ()
+        self.count = 0
+        if not os.path.exists(path):
+            return
+        self.f = open(path, 'rb')
+        header = self.f.read(self.HEADER.size)
+        if len(header) < self.HEADER.size:
+            self.close()
+            raise ValueError(f'Bad archive index: {path}')
+        magic, count = self.HEADER.unpack(header)
+        if magic != self.MAGIC:
+            self.close()
+            raise ValueError(f'Bad archive index: {path}')
+        self.count = count
+        if count > 0:
+            self.mm = mmap.mmap(self.f.fileno(), 0, access=mmap.ACCESS_READ)
+            # a truncated file would silently yield a short key array
+            if len(self.mm) < self.HEADER.size + count * 8:
+                self.close()
+                raise ValueError(f'Truncated archive index: {path}')
+            keys = memoryview(self.mm)[self.HEADER.size:self.HEADER.size + count * 8]
+            self.keys = keys.cast('Q') if sys.byteorder == 'little' else _BigEndianKeys(keys, count)
+
+    @classmethod
+    def key(self, cid):
+        digest = hashlib.blake2b(cid.encode('utf-8'), digest_size=8).digest()
+        return int.from_bytes(digest, 'little')
+
+    @classmethod
+    def get_index_path(self, archive_path):
+        return f'{archive_path[:archive_path.rfind(".")]}.idx'
+
+    @classmethod
+    def write(self, path, cids, tmp_dir=None):
+        # fixed-width hex sorts like the integers, so keys go through the
+        # same bounded-memory external sort as the text archives
+        hex_keys = iter_sorted_unique((f'{self.key(cid):016x}' for cid in cids), tmp_dir=tmp_dir)
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(path)}.', suffix='.tmp', dir=os.path.dirname(path) or None)
+        count = 0
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.HEADER.pack(self.MAGIC, 0))
+            keys = array.array('Q')
+            for hex_key in hex_keys:
+                keys.append(int(hex_key, 16))
+                if len(keys) >= self.WRITE_CHUNK:
+                    count += self._write_keys(f, keys)
+                    keys = array.array('Q')
+            count += self._write_keys(f, keys)
+            f.seek(0)
+            f.write(self.HEADER.pack(self.MAGIC, count))
+        os.replace(tmp_path, path)
+        return count
+
+    @classmethod
+    def _write_keys(self, f, keys):
+        if sys.byteorder != 'little':
+            keys.byteswap()
+        keys.tofile(f)
+        return len(keys)
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, cid):
+        key = self.key(cid)
+        pos = bisect.bisect_left(self.keys, key)
+        return pos < self.count and self.keys[pos] == key
+
+    def close(self):
+        if hasattr(self.keys, 'release'):
+            self.keys.release()
+        self.keys = ()
+        if self.mm is not None:
+            self.mm.close()
+            self.mm = None
+        if self.f is not None:
+            self.f.close()
+            self.f = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        self.close()
+
+
+class _BigEndianKeys(object):
+    def __init__(self, buf, count):
+        self.buf = buf
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        return struct.unpack_from('<Q', self.buf, i * 8)[0]
+
+    def release(self):
+        self.buf.release()
@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+
+from .utils import locked_json
+
+
+class MediaCatalog(object):
+    # (source, id) --> what is on disk, refreshed incrementally: only leaf
+    # dirs (xc_p set dirs, xc_v/xbbs title dirs) whose mtime changed are
+    # listed again, everything else costs a single stat.
+    CATALOG_FILE = 'catalog.json'
+    # bumped when entries change shape, older source states get rebuilt
+    VERSION = 3
+
+    # depth of the dirs holding media files, below the source dir
+    LEAF_DEPTHS = {
+        'xc_p': 2,
+        'xc_v': 1,
+        'xbbs': 1,
+    }
+
+    PHOTO_EXTS = ('.jpg', '.jpeg')
+    VIDEO_EXTS = ('.mp4',)
+    SKIP_EXTS = ('.json', '.txt', '.part', '.ytdl', '.temp')
+    PARTIAL_EXTS = ('.part', '.ytdl', '.temp')
+
+    def __init__(self, conf_dir, work_dir):
+        self.path = os.path.join(conf_dir, self.CATALOG_FILE)
+        self.work_dir = work_dir
+        self.data = {}
+
+    @classmethod
+    def parse_set_name(self, img_set):
+        # "title-NPnV-id" --> (id, NP, NV), parts missing are None
+        if img_set.rfind('-') < 0:
+            return None, None, None
+        img_set_id = img_set[img_set.rfind('-')+1:]
+        img_set_left = img_set[:img_set.rfind('-')]
+        if img_set_left.rfind('-') < 0:
+            return img_set_id, None, None
+        vps = img_set_left[img_set_left.rfind('-')+1:]
+        if vps.find('P') < 0:
+            return img_set_id, None, None
+        img_set_ps = int(vps[:vps.find('P')])
+        img_set_vs = 0
+        if vps.find('V') >= 0:
+            img_set_vs = int(vps[vps.find('P')+1:vps.find('V')])
+        return img_set_id, img_set_ps, img_set_vs
+
+    @classmethod
+    def parse_file_id(self, filename):
+        stem = filename[:filename.rfind('.')] if filename.rfind('.') > 0 else filename
+        if stem.rfind('-') < 0:
+            return None
+        return stem[stem.rfind('-')+1:]
+
+    @classmethod
+    def parse_partial_id(self, filename):
+        # "title-id.f137.mp4.part" --> "id", the item a running download belongs to
+        name = filename
+        while name.lower().endswith(self.PARTIAL_EXTS):
+            name = name[:name.rfind('.')]
+        if name.rfind('-') < 0:
+            return None
+        return name[name.rfind('-')+1:].split('.')[0]
+
+    @classmethod
+    def parse_file_index(self, filename):
+        # xbbs "{playlist_index}-{playlist_id}.ext" --> playlist_index
+        index = filename[:filename.find('-')]
+        return int(index) if index.isdigit() else None
+
+    @classmethod
+    def is_media_file(self, filename):
+        file_low = filename.lower()
+        return not file_low.startswith('.') and not file_low.endswith(self.SKIP_EXTS)
+
+    def _list_leaves(self, root, depth, dirs):
+        # relative leaf path --> mtime, re-listing only parents that changed
+        leaves = {}
+        parents = ['']
+        for level in range(depth):
+            children = []
+            for parent in parents:
+                parent_path = os.path.join(root, parent)
+                try:
+                    mtime = os.stat(parent_path).st_mtime
+                except OSError:
+                    continue
+                if level == depth - 1 or parent not in dirs or dirs[parent]['mtime'] != mtime:
+                    try:
+                        names = [name for name in os.listdir(parent_path)
+                                 if not name.startswith('.') and os.path.isdir(os.path.join(parent_path, name))]
+                    except OSError:
+                        continue
+                    dirs[parent] = {'mtime': mtime, 'children': names}
+                for name in dirs[parent]['children']:
+                    children.append(os.path.join(parent, name) if parent else name)
+            parents = children
+        for rel in parents:
+            try:
+                leaves[rel] = os.stat(os.path.join(root, rel)).st_mtime
+            except OSError:
+                continue
+        return leaves
+
+    def _scan_leaf(self, sid, root, rel):
+        leaf_path = os.path.join(root, rel)
+        entries = {}
+        try:
+            files = os.listdir(leaf_path)
+        except OSError:
+            return entries
+        # downloads still running (or killed) in this dir, per item id; an
+        # xc_v leaf holds many videos, a partial one only blocks its own
+        partial_files = [file for file in files if file.lower().endswith(self.PARTIAL_EXTS)]
+        partial_ids = {}
+        for file in partial_files:
+            partial_id = self.parse_partial_id(file)
+            partial_ids[partial_id] = partial_ids.get(partial_id, 0) + 1
+        if sid == 'xc_p':
+            img_set_id, img_set_ps, img_set_vs = self.parse_set_name(os.path.basename(rel))
+            if img_set_id is None:
+                return entries
+            entry = {'path': leaf_path, 'files': 0, 'size': 0, 'photos': 0, 'videos': 0,
+                     'ps': img_set_ps, 'vs': img_set_vs, 'partial': len(partial_files)}
+            for file in files:
+                if not self.is_media_file(file):
+                    continue
+                file_low = file.lower()
+                if file_low.endswith(self.PHOTO_EXTS):
+                    entry['photos'] += 1
+                elif file_low.endswith(self.VIDEO_EXTS):
+                    entry['videos'] += 1
+                entry['files'] += 1
+                entry['size'] += os.path.getsize(os.path.join(leaf_path, file))
+            entries[img_set_id] = entry
+        else:
+            for file in files:
+                if not self.is_media_file(file):
+                    continue
+                file_id = self.parse_file_id(file)
+                if file_id is None:
+                    continue
+                file_path = os.path.join(leaf_path, file)
+                entry = entries.setdefault(file_id, {
+                    'path': file_path if sid == 'xc_v' else leaf_path, 'files': 0, 'size': 0,
+                    'partial': partial_ids.get(file_id, 0), 'indexes': []})
+                entry['files'] += 1
+                entry['size'] += os.path.getsize(file_path)
+                if sid == 'xbbs':
+                    index = self.parse_file_index(file)
+                    if index is not None:
+                        entry['indexes'].append(index)
+            for entry in entries.values():
+                entry['indexes'] = sorted(set(entry['indexes']))
+        return entries
+
+    def refresh_source(self, sid):
+        root = os.path.join(self.work_dir, sid)
+        state = self.data.get(sid)
+        if state is None or state.get('version') != self.VERSION:
+            state = self.data[sid] = {'version': self.VERSION, 'dirs': {}, 'leaves': {}, 'entries': {}}
+        if not os.path.isdir(root):
+            state['dirs'], state['leaves'], state['entries'] = {}, {}, {}
+            return 0
+        leaves = self._list_leaves(root, self.LEAF_DEPTHS.get(sid, 1), state['dirs'])
+        changed = 0
+        for rel in list(state['leaves'].keys()):
+            if rel not in leaves or leaves[rel] != state['leaves'][rel]['mtime']:
+                for entry_id in state['leaves'].pop(rel)['ids']:
+                    entry = state['entries'].get(entry_id)
+                    if entry and entry['leaf'] == rel:
+                        del state['entries'][entry_id]
+                if rel not in leaves:
+                    changed += 1
+        for rel, mtime in leaves.items():
+            if rel in state['leaves']:
+                continue
+            entries = self._scan_leaf(sid, root, rel)
+            for entry_id, entry in entries.items():
+                entry['leaf'] = rel
+                state['entries'][entry_id] = entry
+            state['leaves'][rel] = {'mtime': mtime, 'ids': list(entries.keys())}
+            changed += 1
+        return changed
+
+    def refresh(self, sids=None):
+        with locked_json(self.path) as catalog:
+            self.data = catalog.data
+            for sid in (sids or self.LEAF_DEPTHS.keys()):
+                changed = self.refresh_source(sid)
+                print(f'[=] Catalog {sid}: {len(self.data[sid]["entries"])} sets, refreshed dirs: {changed}')
+        return self
+
+    def get(self, sid, entry_id):
+        return self.data.get(sid, {}).get('entries', {}).get(entry_id, None)
+
+    def is_satisfied(self, sid, entry_id):
+        # only when completeness can be proven, anything else is left to
+        # youtube-dl and its download archive
+        entry = self.get(sid, entry_id)
+        if entry is None or entry['files'] <= 0 or entry['size'] <= 0 or entry.get('partial', 1) > 0:
+            return False
+        if sid == 'xc_p':
+            if entry['ps'] is None:
+                return False
+            # same tolerance as scan: one missing photo is fine, videos must match
+            return entry['ps'] - entry['photos'] <= 1 and entry['vs'] == entry['videos']
+        if sid == 'xc_v':
+            # a single file, renamed from .part only once complete
+            return True
+        if sid == 'xbbs':
+            # entries numbered 1..n without a gap, none of them in progress
+            indexes = entry.get('indexes', [])
+            return len(indexes) > 0 and indexes == list(range(1, len(indexes) + 1))
+        return False
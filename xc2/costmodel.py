@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import heapq
+import urllib.parse
+
+from .utils import locked_json
+
+
+class CostModel(object):
+    # Moving averages of wall time and bytes, per source+URL kind and per
+    # list URL, learned from finished downloads and used to plan new ones.
+    COST_FILE = 'costs.json'
+    ALPHA = 0.3
+
+    LIST_KINDS = ['photos', 'videos', 'forum', 'user', 'model']
+    DEFAULT_SECONDS = {
+        'photo': 30.0,
+        'video': 120.0,
+        'thread': 30.0,
+        'photos': 300.0,
+        'videos': 600.0,
+        'forum': 300.0,
+        'user': 300.0,
+    }
+
+    def __init__(self, conf_dir):
+        self.path = os.path.join(conf_dir, self.COST_FILE)
+        self.data = {'kinds': {}, 'lists': {}}
+        if os.path.exists(self.path):
+            with locked_json(self.path, self.data) as costs:
+                self.data = costs.data
+
+    @classmethod
+    def url_kind(self, url):
+        parts = urllib.parse.urlparse(url).path.strip('/').split('/')
+        return parts[0] if len(parts) > 0 else ''
+
+    @classmethod
+    def list_key(self, url):
+        # list URL without query and page number, same form as in lists.txt
+        path = urllib.parse.urlparse(url)._replace(query='', fragment='').geturl()
+        number = path[path.rfind('/')+1:path.rfind('.')]
+        if number.isnumeric():
+            return f'{path[:path.rfind("/")]}.html'
+        return path
+
+    @classmethod
+    def _update(self, stats, seconds, size):
+        if stats is None:
+            return {'seconds': seconds, 'bytes': size, 'count': 1}
+        stats['seconds'] += self.ALPHA * (seconds - stats['seconds'])
+        stats['bytes'] += self.ALPHA * (size - stats['bytes'])
+        stats['count'] += 1
+        return stats
+
+    def record(self, sid, url, seconds, size=0):
+        kind = self.url_kind(url)
+        with locked_json(self.path, self.data) as costs:
+            kind_key = f'{sid}:{kind}'
+            costs.data['kinds'][kind_key] = self._update(costs.data['kinds'].get(kind_key), seconds, size)
+            if kind in self.LIST_KINDS:
+                list_key = self.list_key(url)
+                costs.data['lists'][list_key] = self._update(costs.data['lists'].get(list_key), seconds, size)
+            self.data = costs.data
+
+    def estimate(self, sid, url):
+        # --> (seconds, bytes), most specific history first
+        kind = self.url_kind(url)
+        stats = None
+        if kind in self.LIST_KINDS:
+            stats = self.data['lists'].get(self.list_key(url))
+        if stats is None:
+            stats = self.data['kinds'].get(f'{sid}:{kind}')
+        if stats is None:
+            return self.DEFAULT_SECONDS.get(kind, 60.0), 0
+        return stats['seconds'], stats['bytes']
+
+    @classmethod
+    def split_balanced(self, items, shards, cost=lambda item: 1.0):
+        # greedy longest-processing-time-first: each item to the least
+        # loaded shard, keeping items longest-first inside every shard
+        shards = max(1, min(shards, len(items)))
+        heap = [(0.0, i) for i in range(shards)]
+        ret = [[] for i in range(shards)]
+        for item in sorted(items, key=cost, reverse=True):
+            load, i = heapq.heappop(heap)
+            ret[i].append(item)
+            heapq.heappush(heap, (load + cost(item), i))
+        return ret
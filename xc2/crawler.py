@@ -0,0 +1,130 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import re
+import http.client
+import urllib.error
+import urllib.parse
+import urllib.request
+import concurrent.futures
+
+
+class ListCrawler(object):
+    # Walks paginated list pages a small window at a time, pages of a window
+    # fetched concurrently, and stops at the first page without new ids.
+    ITEM_PATTERNS = {
+        'xc_p': re.compile(r'/photo/id-([0-9A-Za-z]+)\.html'),
+        'xc_v': re.compile(r'/video/id-([0-9A-Za-z]+)\.html'),
+        'xbbs': re.compile(r'/thread/id-([0-9A-Za-z]+)\.html'),
+    }
+    # ids only count inside the list container, not in sidebars or
+    # recommendations: the first element with one of these classes that
+    # holds any item link, up to its matching close tag
+    LIST_CLASSES = {
+        'xc_p': {'photos', 'photo-list', 'list'},
+        'xc_v': {'videos', 'video-list', 'list'},
+        'xbbs': {'threads', 'thread-list', 'list'},
+    }
+    CONTAINER_PATTERN = re.compile(r'<(div|ul|ol|section|table|tbody)\b[^>]*?\bclass\s*=\s*["\']([^"\']*)["\']', re.I)
+
+    def __init__(self, workers=4, rate_limiter=None, user_agent=None, timeout=30, max_pages=1000):
+        self.workers = max(1, int(workers))
+        self.rate_limiter = rate_limiter
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.max_pages = max_pages
+
+    @classmethod
+    def find_container(self, sid, text):
+        # html of the list container, None if the page has none
+        for match in self.CONTAINER_PATTERN.finditer(text):
+            if not self.LIST_CLASSES[sid].intersection(match.group(2).lower().split()):
+                continue
+            tag_pattern = re.compile(rf'<(/?){match.group(1)}\b', re.I)
+            depth = 0
+            end = len(text)
+            for tag in tag_pattern.finditer(text, match.start()):
+                depth += -1 if tag.group(1) else 1
+                if depth <= 0:
+                    end = tag.end()
+                    break
+            region = text[match.start():end]
+            if self.ITEM_PATTERNS[sid].search(region):
+                return region
+        return None
+
+    @classmethod
+    def extract_ids(self, sid, text):
+        # --> ids in the list container, None if there is no container
+        region = self.find_container(sid, text)
+        if region is None:
+            return None
+        ids = []
+        seen = set()
+        for match in self.ITEM_PATTERNS[sid].finditer(region):
+            item_id = match.group(1)
+            if item_id not in seen:
+                seen.add(item_id)
+                ids.append(item_id)
+        return ids
+
+    def fetch(self, url, referer=None):
+        # page text, or None once past the last page
+        ret = urllib.parse.urlparse(url)
+        host = f'{ret.scheme}://{ret.netloc}/'
+        if self.rate_limiter:
+            self.rate_limiter.acquire(host)
+        headers = {}
+        if self.user_agent:
+            headers['User-Agent'] = self.user_agent
+        if referer:
+            headers['Referer'] = referer
+        try:
+            with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=self.timeout) as resp:
+                text = resp.read().decode('utf-8', errors='replace')
+        except urllib.error.HTTPError as e:
+            if self.rate_limiter:
+                self.rate_limiter.report(host, throttled=e.code in (429, 503))
+            if e.code == 404:
+                return None
+            raise
+        except (urllib.error.URLError, ConnectionResetError, http.client.HTTPException) as e:
+            if self.rate_limiter:
+                self.rate_limiter.report(host, throttled=isinstance(getattr(e, 'reason', e), ConnectionResetError))
+            raise
+        if self.rate_limiter:
+            self.rate_limiter.report(host)
+        return text
+
+    def crawl(self, sid, page_url_format, is_archived, referer=None, first_page=1, early_stop=True):
+        # --> new item ids, newest first as listed
+        new_ids = []
+        seen = set()
+        page = first_page
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.workers) as pool:
+            while page < first_page + self.max_pages:
+                pages = range(page, page + self.workers)
+                texts = list(pool.map(lambda p: self.fetch(page_url_format % p, referer), pages))
+                for p, text in zip(pages, texts):
+                    if text is None:
+                        return new_ids
+                    ids = self.extract_ids(sid, text)
+                    if ids is None:
+                        # an unknown layout on the first page, else an empty page past the end
+                        if p == first_page:
+                            raise ValueError(f'No list container found: {page_url_format % p}')
+                        return new_ids
+                    page_new = [item_id for item_id in ids if item_id not in seen]
+                    # past the end some sites repeat the last page
+                    if len(page_new) <= 0:
+                        return new_ids
+                    seen.update(page_new)
+                    fresh = [item_id for item_id in page_new if not is_archived(item_id)]
+                    new_ids.extend(fresh)
+                    if early_stop and len(fresh) <= 0:
+                        print(f'[=] Crawl stopped at page {p}, nothing new: {page_url_format % p}')
+                        return new_ids
+                page += self.workers
+        return new_ids
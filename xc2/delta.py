@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import io
+import json
+import time
+import tarfile
+
+from .catalog import MediaCatalog
+from .utils import locked_json
+
+
+class DeltaExporter(object):
+    # Named checkpoints of the catalog's leaf dirs (mtime + ids per leaf).
+    # Diffing two of them finds the sets added, changed, moved or merged
+    # without walking the library; only changed leaves get listed.
+    CHECKPOINT_DIR = 'checkpoints'
+    PARTIAL_EXTS = ('.part', '.ytdl', '.temp')
+    KINDS = ['added', 'changed', 'relocated', 'merged']
+
+    def __init__(self, conf_dir, work_dir):
+        self.conf_dir = conf_dir
+        self.work_dir = work_dir
+        self.checkpoint_dir = os.path.join(conf_dir, self.CHECKPOINT_DIR)
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir)
+
+    def get_checkpoint_path(self, name):
+        return os.path.join(self.checkpoint_dir, f'{name}.json')
+
+    @classmethod
+    def snapshot(self, catalog):
+        sources = {}
+        for sid, state in catalog.data.items():
+            sources[sid] = {rel: {'mtime': leaf['mtime'], 'ids': leaf['ids']}
+                            for rel, leaf in state.get('leaves', {}).items()}
+        return {'created': int(time.time()), 'sources': sources}
+
+    @classmethod
+    def diff_source(self, prev_leaves, curr_leaves):
+        # --> {kind: [leaf]}, plus leaves gone from disk
+        def leaves_by_id(leaves):
+            ret = {}
+            for rel, leaf in leaves.items():
+                for entry_id in leaf['ids']:
+                    ret.setdefault(entry_id, set()).add(rel)
+            return ret
+        prev_ids = leaves_by_id(prev_leaves)
+        curr_ids = leaves_by_id(curr_leaves)
+
+        ret = {kind: [] for kind in self.KINDS}
+        kinds = {}
+        for rel, leaf in curr_leaves.items():
+            if rel not in prev_leaves:
+                # re_locate_set: the id was at a leaf that is gone now
+                moved = any(old not in curr_leaves
+                            for entry_id in leaf['ids'] for old in prev_ids.get(entry_id, ()))
+                kinds[rel] = 'relocated' if moved else 'added'
+            elif leaf['mtime'] != prev_leaves[rel]['mtime']:
+                kinds[rel] = 'changed'
+        deleted = []
+        for rel, leaf in prev_leaves.items():
+            if rel in curr_leaves:
+                continue
+            deleted.append(rel)
+            # dup_id_set merges into a set dir that was already there
+            for entry_id in leaf['ids']:
+                for target in curr_ids.get(entry_id, ()):
+                    if target in prev_leaves and target in kinds:
+                        kinds[target] = 'merged'
+        for rel, kind in kinds.items():
+            ret[kind].append(rel)
+        for kind in self.KINDS:
+            ret[kind].sort()
+        return ret, sorted(deleted)
+
+    def list_leaf_files(self, sid, rel, since=None, new_ids=()):
+        # files relative to work dir, downloads still in progress left out;
+        # with since, only files created (ctime: renames count, mtime is the
+        # server's) after it or carrying a new id, an xc_v leaf is a whole
+        # uploader dir
+        leaf_path = os.path.join(self.work_dir, sid, rel)
+        files = []
+        for dirpath, dirnames, filenames in os.walk(leaf_path):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                if filename.startswith('.') or filename.lower().endswith(self.PARTIAL_EXTS):
+                    continue
+                file_path = os.path.join(dirpath, filename)
+                if since is not None and MediaCatalog.parse_file_id(filename) not in new_ids \
+                        and os.stat(file_path).st_ctime <= since:
+                    continue
+                files.append(os.path.relpath(file_path, self.work_dir))
+        return files
+
+    def write_file_list(self, files, output_path):
+        tmp_path = f'{output_path}.tmp'
+        with io.open(tmp_path, 'w', encoding='utf-8') as f:
+            for file in files:
+                f.write(f'{file}\n')
+        os.replace(tmp_path, output_path)
+
+    def write_tar(self, files, output_path):
+        mode = 'w|gz' if output_path.endswith(('.tar.gz', '.tgz')) else 'w|'
+        tmp_path = f'{output_path}.tmp'
+        with tarfile.open(tmp_path, mode) as tar:
+            for file in files:
+                tar.add(os.path.join(self.work_dir, file), arcname=file, recursive=False)
+        os.replace(tmp_path, output_path)
+
+    def export(self, name, output_path, sids=None):
+        catalog = MediaCatalog(self.conf_dir, self.work_dir).refresh(sids)
+        checkpoint_path = self.get_checkpoint_path(name)
+        with locked_json(checkpoint_path, {'created': 0, 'sources': {}}) as checkpoint:
+            prev = checkpoint.data
+            curr = self.snapshot(catalog)
+            if sids:
+                # sources not exported keep their old checkpoint
+                for sid, leaves in prev['sources'].items():
+                    if sid not in sids:
+                        curr['sources'][sid] = leaves
+            print(f'[=] Checkpoint "{name}" from: {prev["created"]} --> {checkpoint_path}')
+
+            files = []
+            deleted = []
+            summary = {}
+            for sid in sorted(curr['sources'].keys()):
+                if sids and sid not in sids:
+                    continue
+                prev_leaves = prev['sources'].get(sid, {})
+                changes, gone = self.diff_source(prev_leaves, curr['sources'][sid])
+                for kind in self.KINDS:
+                    summary[f'{sid}:{kind}'] = len(changes[kind])
+                    for rel in changes[kind]:
+                        if kind == 'changed':
+                            # only what is new in a leaf that was there already
+                            new_ids = set(curr['sources'][sid][rel]['ids']) - set(prev_leaves[rel]['ids'])
+                            files.extend(self.list_leaf_files(sid, rel, since=prev['created'], new_ids=new_ids))
+                        else:
+                            files.extend(self.list_leaf_files(sid, rel))
+                summary[f'{sid}:deleted'] = len(gone)
+                deleted.extend(os.path.join(sid, rel) for rel in gone)
+
+            if output_path.endswith(('.tar', '.tar.gz', '.tgz')):
+                self.write_tar(files, output_path)
+            else:
+                self.write_file_list(files, output_path)
+            self.write_file_list(deleted, f'{output_path}.deleted.txt')
+
+            # the previous checkpoint stays around, to redo a failed transfer
+            with io.open(f'{checkpoint_path[:checkpoint_path.rfind(".")]}.prev.json', 'w', encoding='utf-8') as f:
+                json.dump(prev, f)
+            checkpoint.data = curr
+        return files, deleted, summary
@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import threading
+
+from .catalog import MediaCatalog
+from .costmodel import CostModel
+
+
+class DiskAdmission(object):
+    # Admits a download only while free space minus what the running
+    # downloads are still expected to write stays above the watermark.
+    # Each running download holds a reservation of its estimate and the
+    # files it writes to; bytes already on disk count against free space
+    # only. Waiters wake up when a download ends, else on poll.
+    UNITS = {'K': 1 << 10, 'M': 1 << 20, 'G': 1 << 30, 'T': 1 << 40}
+
+    def __init__(self, path, watermark, poll_interval=30.0):
+        self.path = path
+        self.watermark = watermark
+        self.poll_interval = poll_interval
+        self.cond = threading.Condition()
+        self.reservations = []
+        self.paused = False
+        self.closed = False
+
+    @classmethod
+    def parse_watermark(self, text):
+        # "95%" --> max share of the filesystem in use, "20G" --> free space to keep
+        text = text.strip().upper()
+        if text.endswith('%'):
+            return ('percent', float(text[:-1]))
+        if text.endswith('B'):
+            text = text[:-1]
+        unit = self.UNITS.get(text[-1:], None)
+        if unit:
+            return ('bytes', int(float(text[:-1]) * unit))
+        return ('bytes', int(text))
+
+    def usage(self):
+        # --> (free, total) bytes for unprivileged writers
+        st = os.statvfs(self.path)
+        return st.f_bavail * st.f_frsize, st.f_blocks * st.f_frsize
+
+    def keep_free(self, total):
+        kind, value = self.watermark
+        if kind == 'percent':
+            return int(total * (100.0 - value) / 100.0)
+        return value
+
+    @classmethod
+    def written(self, files):
+        # bytes on disk so far, youtube-dl writes to "<file>.part" until done
+        size = 0
+        for file in list(files):
+            for path in (file, f'{file}.part'):
+                if os.path.exists(path):
+                    size += os.path.getsize(path)
+                    break
+        return size
+
+    def reserved(self):
+        return sum(max(0, r['size'] - self.written(r['files'])) for r in self.reservations)
+
+    def admissible(self, size):
+        free, total = self.usage()
+        projected = free - self.reserved() - size
+        if projected >= self.keep_free(total):
+            return True
+        # estimates can be pessimistic, an idle disk above the mark is not stuck
+        return len(self.reservations) <= 0 and free >= self.keep_free(total)
+
+    def acquire(self, size):
+        # --> reservation, the caller adds the files being written to its "files"
+        with self.cond:
+            while not self.admissible(size):
+                if self.closed:
+                    raise IOError('Disk admission closed while waiting for space')
+                if not self.paused:
+                    self.paused = True
+                    free, total = self.usage()
+                    print(f'[X] Disk watermark reached, pausing downloads: free {free >> 20}MB, '
+                          f'reserved {self.reserved() >> 20}MB, next {size >> 20}MB, keep {self.keep_free(total) >> 20}MB')
+                self.cond.wait(self.poll_interval)
+            if self.paused:
+                self.paused = False
+                print(f'[=] Disk space available again, resuming downloads')
+            reservation = {'size': size, 'files': []}
+            self.reservations.append(reservation)
+            return reservation
+
+    def release(self, reservation):
+        with self.cond:
+            self.reservations.remove(reservation)
+            self.cond.notify_all()
+
+    def close(self):
+        # wakes up every waiter, none of them gets admitted any more
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+
+class SizeEstimator(object):
+    # Bytes a download is going to write: photo sets from their NP/NV counts
+    # times the per-photo/per-video sizes fitted on the catalog, minus what
+    # is on disk already, else the cost model history, else a default.
+    DEFAULT_BYTES = {
+        'photo': 64 << 20,
+        'video': 512 << 20,
+        'thread': 32 << 20,
+    }
+    DEFAULT_LIST_BYTES = 1 << 30
+    DEFAULT_PHOTO_BYTES = 512 << 10
+    DEFAULT_VIDEO_BYTES = 64 << 20
+
+    def __init__(self, cost_model, catalog=None):
+        self.cost_model = cost_model
+        self.catalog = catalog
+        self.photo_bytes, self.video_bytes = self.fit(catalog)
+
+    @classmethod
+    def fit(self, catalog):
+        # least squares of size ~ a * photos + b * videos over the sets on disk
+        spp = spv = svv = sps = svs = 0.0
+        if catalog is not None:
+            for entry in catalog.data.get('xc_p', {}).get('entries', {}).values():
+                p, v, size = entry['photos'], entry['videos'], entry['size']
+                if p + v <= 0 or size <= 0:
+                    continue
+                spp += p * p
+                spv += p * v
+                svv += v * v
+                sps += p * size
+                svs += v * size
+        det = spp * svv - spv * spv
+        if det > 0:
+            a = (sps * svv - svs * spv) / det
+            b = (svs * spp - sps * spv) / det
+            if a > 0 and b > 0:
+                return a, b
+        if spp > 0 and svv <= 0:
+            return sps / spp, self.DEFAULT_VIDEO_BYTES
+        return self.DEFAULT_PHOTO_BYTES, self.DEFAULT_VIDEO_BYTES
+
+    @classmethod
+    def get_output_template(self, argv):
+        if '-o' in argv and argv.index('-o') + 1 < len(argv):
+            return argv[argv.index('-o') + 1]
+        return ''
+
+    def estimate(self, job):
+        key = job.key or job.url
+        if job.sid == 'xc_p':
+            # scan fixes write into a known set dir, named "title-NPnV-id"
+            set_name = os.path.basename(os.path.dirname(self.get_output_template(job.argv)))
+            set_id, ps, vs = MediaCatalog.parse_set_name(set_name) if '%(' not in set_name else (None, None, None)
+            if set_id is None and '/photo/id-' in key:
+                set_id = key[key.find('/photo/id-')+len('/photo/id-'):key.rfind('.html')]
+            entry = self.catalog.get(job.sid, set_id) if self.catalog is not None and set_id else None
+            if ps is None and entry is not None:
+                ps, vs = entry['ps'], entry['vs']
+            if ps is not None:
+                size = int(ps * self.photo_bytes + (vs or 0) * self.video_bytes)
+                return max(0, size - (entry['size'] if entry else 0))
+        _, size = self.cost_model.estimate(job.sid, key)
+        if size > 0:
+            return int(size)
+        kind = CostModel.url_kind(key)
+        if kind in CostModel.LIST_KINDS:
+            return self.DEFAULT_LIST_BYTES
+        return self.DEFAULT_BYTES.get(kind, self.DEFAULT_BYTES['photo'])
@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import re
+import sys
+import time
+import threading
+import subprocess
+import collections
+import concurrent.futures
+
+DownloadJob = collections.namedtuple(
+    'DownloadJob', ['sid', 'key', 'url', 'argv', 'host', 'update_pl_archive'])
+DownloadResult = collections.namedtuple(
+    'DownloadResult', ['job', 'returncode', 'output', 'elapsed', 'files', 'bytes'])
+
+
+class DownloadExecutor(object):
+    OUTPUT_TAIL_LINES = 20
+    DESTINATION_PATTERN = re.compile(r'^\[download\] Destination: (.+)$')
+
+    def __init__(self, workers=1, rate_limiter=None, on_archive_update=None, on_result=None, keep_results=True,
+                 admission=None, estimate_bytes=None):
+        self.workers = max(1, int(workers))
+        self.rate_limiter = rate_limiter
+        self.admission = admission
+        self.estimate_bytes = estimate_bytes
+        self.on_archive_update = on_archive_update
+        self.on_result = on_result
+        self.keep_results = keep_results
+        self.pool = None
+        self.futures = set()
+        self.results = []
+        self.lock = threading.Lock()
+        self.archive_locks = {}
+        self.submitted = 0
+
+    def start(self):
+        if self.pool is None:
+            self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=self.workers)
+        return self
+
+    def submit(self, job):
+        self.start()
+        with self.lock:
+            self.submitted += 1
+            index = self.submitted
+        future = self.pool.submit(self._run_job, job, index)
+        with self.lock:
+            self.futures.add(future)
+        future.add_done_callback(self._discard_future)
+        return future
+
+    def _discard_future(self, future):
+        with self.lock:
+            self.futures.discard(future)
+
+    def pending(self):
+        with self.lock:
+            return len(self.futures)
+
+    def cancel(self):
+        with self.lock:
+            futures = list(self.futures)
+        for future in futures:
+            future.cancel()
+        if self.admission is not None:
+            self.admission.close()
+
+    def join(self):
+        with self.lock:
+            futures = list(self.futures)
+        try:
+            for future in concurrent.futures.as_completed(futures):
+                future.result()
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
+        return self.results
+
+    def run(self, jobs):
+        for job in jobs:
+            self.submit(job)
+        return self.join()
+
+    def _archive_lock(self, sid):
+        with self.lock:
+            if sid not in self.archive_locks:
+                self.archive_locks[sid] = threading.Lock()
+            return self.archive_locks[sid]
+
+    def _run_job(self, job, index):
+        if self.admission is None:
+            return self._do_run_job(job, index)
+        reserve = self.estimate_bytes(job) if self.estimate_bytes else 0
+        reservation = self.admission.acquire(reserve)
+        try:
+            # files get appended as they are parsed, the admission sees them grow
+            return self._do_run_job(job, index, reservation['files'])
+        finally:
+            self.admission.release(reservation)
+
+    def _do_run_job(self, job, index, files=None):
+        if self.rate_limiter:
+            self.rate_limiter.acquire(job.host)
+
+        print(f'[=] [{index}/{self.submitted}] {job.sid}: {job.url}')
+        start = time.time()
+        tail = collections.deque(maxlen=self.OUTPUT_TAIL_LINES)
+        files = files if files is not None else []
+        try:
+            proc = subprocess.Popen(job.argv,
+                                    stdout=subprocess.PIPE,
+                                    stderr=subprocess.STDOUT,
+                                    universal_newlines=True,
+                                    encoding='utf-8',
+                                    errors='replace')
+            for line in proc.stdout:
+                tail.append(line)
+                sys.stdout.write(line)
+                match = self.DESTINATION_PATTERN.match(line.rstrip('\n'))
+                if match:
+                    files.append(match.group(1))
+            returncode = proc.wait()
+        except OSError as ose:
+            tail.append(f'ERROR: {ose}\n')
+            returncode = -1
+        elapsed = time.time() - start
+        output = ''.join(tail)
+        size = 0
+        for file in files:
+            if os.path.exists(file):
+                size += os.path.getsize(file)
+
+        if self.rate_limiter:
+            self.rate_limiter.report(job.host, throttled=self.rate_limiter.is_throttled(output))
+
+        if job.update_pl_archive and self.on_archive_update:
+            with self._archive_lock(job.sid):
+                self.on_archive_update(job.sid)
+
+        result = DownloadResult(job=job, returncode=returncode, output=output, elapsed=elapsed, files=files, bytes=size)
+        if self.on_result:
+            self.on_result(result)
+        if self.keep_results:
+            with self.lock:
+                self.results.append(result)
+        if returncode == 0:
+            print(f'[+] Done in {elapsed:.1f}s - {job.sid}: {job.url}')
+        else:
+            print(f'[X] Failed ({returncode}) in {elapsed:.1f}s - {job.sid}: {job.url}')
+        return result
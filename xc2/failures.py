@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+
+from .utils import locked_json
+
+
+class FailureJournal(object):
+    JOURNAL_FILE = 'failures.json'
+
+    REASON_UNSUPPORTED = 'unsupported'
+    REASON_HTTP = 'http'
+    REASON_TIMEOUT = 'timeout'
+    REASON_EXTRACTOR = 'extractor'
+    REASON_UNKNOWN = 'unknown'
+
+    STATUS_PENDING = 'pending'
+    STATUS_DISPATCHED = 'dispatched'
+    STATUS_PARKED = 'parked'
+
+    BACKOFF_BASE = 600
+    BACKOFF_MAX = 86400
+    MAX_ATTEMPTS = 6
+    DISPATCHED_TTL = 7 * 86400
+
+    UNSUPPORTED_PATTERN = re.compile(r'Unsupported URL')
+    HTTP_PATTERN = re.compile(r'HTTP Error (\d{3})')
+    TIMEOUT_PATTERN = re.compile(r'timed out|TimeoutError|ETIMEDOUT', re.IGNORECASE)
+    EXTRACTOR_PATTERN = re.compile(r'ERROR:')
+
+    def __init__(self, conf_dir):
+        self.path = os.path.join(conf_dir, self.JOURNAL_FILE)
+
+    @classmethod
+    def classify(self, output):
+        if self.UNSUPPORTED_PATTERN.search(output):
+            return self.REASON_UNSUPPORTED, None
+        match = self.HTTP_PATTERN.search(output)
+        if match:
+            return self.REASON_HTTP, int(match.group(1))
+        if self.TIMEOUT_PATTERN.search(output):
+            return self.REASON_TIMEOUT, None
+        if self.EXTRACTOR_PATTERN.search(output):
+            return self.REASON_EXTRACTOR, None
+        return self.REASON_UNKNOWN, None
+
+    @classmethod
+    def is_permanent(self, reason, detail=None):
+        if reason == self.REASON_UNSUPPORTED:
+            return True
+        if reason == self.REASON_HTTP and detail is not None:
+            # 4xx other than timeout / throttling won't get better by waiting
+            return 400 <= detail < 500 and detail not in (408, 429)
+        return False
+
+    @classmethod
+    def backoff(self, attempts):
+        return min(self.BACKOFF_MAX, self.BACKOFF_BASE * (2 ** max(0, attempts - 1)))
+
+    def record(self, sid, url, reason, detail=None, now=None, recent_only=None):
+        now = time.time() if now is None else now
+        with locked_json(self.path) as journal:
+            entry = journal.data.get(url, {
+                'sid': sid,
+                'url': url,
+                'attempts': 0,
+            })
+            entry['sid'] = sid
+            entry['attempts'] += 1
+            entry['reason'] = reason
+            entry['detail'] = detail
+            entry['last'] = now
+            # the sync mode it first failed in, retries re-sync lists the same way
+            if recent_only is not None and 'recent_only' not in entry:
+                entry['recent_only'] = recent_only
+            if self.is_permanent(reason, detail) or entry['attempts'] >= self.MAX_ATTEMPTS:
+                entry['status'] = self.STATUS_PARKED
+                entry['next'] = None
+            else:
+                entry['status'] = self.STATUS_PENDING
+                entry['next'] = now + self.backoff(entry['attempts'])
+            journal.data[url] = entry
+            return entry
+
+    def record_output(self, sid, url, output, now=None, recent_only=None):
+        reason, detail = self.classify(output)
+        return self.record(sid, url, reason, detail, now, recent_only)
+
+    def resolve(self, url):
+        with locked_json(self.path) as journal:
+            return journal.data.pop(url, None)
+
+    def resolve_urls(self, urls):
+        with locked_json(self.path) as journal:
+            return [journal.data.pop(url) for url in urls if url in journal.data]
+
+    def entries(self):
+        with locked_json(self.path) as journal:
+            return dict(journal.data)
+
+    def eligible(self, now=None):
+        # pending entries due for a retry; planning only, see dispatch
+        now = time.time() if now is None else now
+        eligible = []
+        with locked_json(self.path) as journal:
+            for url in list(journal.data.keys()):
+                entry = journal.data[url]
+                if entry['status'] == self.STATUS_PENDING and entry['next'] <= now:
+                    eligible.append(entry)
+                elif entry['status'] == self.STATUS_DISPATCHED \
+                        and entry.get('dispatched', 0) + self.DISPATCHED_TTL < now:
+                    # no failure reported since dispatch, consider it done
+                    del journal.data[url]
+        return eligible
+
+    def dispatch(self, urls, now=None):
+        # marks entries whose retry is actually being executed
+        now = time.time() if now is None else now
+        dispatched = []
+        with locked_json(self.path) as journal:
+            for url in urls:
+                entry = journal.data.get(url)
+                if entry is not None and entry['status'] == self.STATUS_PENDING:
+                    entry['status'] = self.STATUS_DISPATCHED
+                    entry['dispatched'] = now
+                    dispatched.append(entry)
+        return dispatched
+
+    def summary(self):
+        ret = {}
+        with locked_json(self.path) as journal:
+            for entry in journal.data.values():
+                key = f'{entry["status"]}:{entry["reason"]}'
+                ret[key] = ret.get(key, 0) + 1
+        return ret
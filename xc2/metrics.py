@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import io
+import time
+import threading
+import http.server
+
+from .utils import locked_file
+
+
+class MetricsRegistry(object):
+    # Counters are kept as deltas and merged into the textfile on flush, so
+    # several xchina2 processes sharing a conf dir add up instead of
+    # overwriting each other. Flushes are throttled, updates are in-memory.
+    METRICS_FILE = 'xchina2.prom'
+
+    METRICS = {
+        'xchina2_items_planned_total': ('counter', 'Download items planned, per source.'),
+        'xchina2_items_completed_total': ('counter', 'Download items finished successfully, per source.'),
+        'xchina2_items_failed_total': ('counter', 'Download items failed, per source and failure class.'),
+        'xchina2_downloaded_bytes_total': ('counter', 'Bytes of media files written, per source.'),
+        'xchina2_item_duration_seconds': ('summary', 'Wall time of download items, per source.'),
+        'xchina2_sync_last_planned_timestamp_seconds': ('gauge', 'Last time a list URL was planned for download.'),
+        'xchina2_sync_last_success_timestamp_seconds': ('gauge', 'Last time a list URL download finished successfully.'),
+        'xchina2_scan_last_timestamp_seconds': ('gauge', 'Last time a library scan finished.'),
+        'xchina2_scan_findings': ('gauge', 'Findings of the last library scan, per kind.'),
+    }
+    # sample suffixes of a family, in exposition order
+    SUFFIXES = {
+        'summary': ['_sum', '_count'],
+    }
+
+    def __init__(self, path=None, flush_interval=5.0):
+        self.path = path
+        self.flush_interval = flush_interval
+        self.lock = threading.Lock()
+        self.deltas = {}
+        self.gauges = {}
+        self.last_flush = 0.0
+        self.server = None
+
+    def setPath(self, path):
+        self.path = path
+
+    @classmethod
+    def series(self, name, labels=None):
+        if not labels:
+            return name
+        label_str = ','.join(
+            '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+            for k, v in sorted(labels.items()))
+        return f'{name}{{{label_str}}}'
+
+    def inc(self, name, labels=None, value=1):
+        key = self.series(name, labels)
+        with self.lock:
+            self.deltas[key] = self.deltas.get(key, 0) + value
+
+    def set(self, name, value, labels=None):
+        key = self.series(name, labels)
+        with self.lock:
+            self.gauges[key] = value
+
+    @classmethod
+    def parse(self, text):
+        values = {}
+        for line in text.splitlines():
+            if not line or line.startswith('#'):
+                continue
+            key, _, value = line.rpartition(' ')
+            try:
+                values[key] = float(value)
+            except ValueError:
+                continue
+        return values
+
+    @classmethod
+    def render(self, values):
+        lines = []
+        for name in sorted(self.METRICS.keys()):
+            type, help = self.METRICS[name]
+            suffixes = self.SUFFIXES.get(type, [''])
+            # samples of one label set stay together: (labels, suffix) order
+            samples = []
+            for key in values.keys():
+                for index, suffix in enumerate(suffixes):
+                    sample = f'{name}{suffix}'
+                    if key == sample or key.startswith(f'{sample}{{'):
+                        samples.append((key[len(sample):], index, key))
+            if len(samples) <= 0:
+                continue
+            keys = [key for _, _, key in sorted(samples)]
+            lines.append(f'# HELP {name} {help}')
+            lines.append(f'# TYPE {name} {type}')
+            for key in keys:
+                value = values[key]
+                lines.append(f'{key} {int(value) if value == int(value) else value}')
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, force=False):
+        if not self.path:
+            return None
+        now = time.time()
+        with self.lock:
+            if not force and now - self.last_flush < self.flush_interval:
+                return None
+            deltas, self.deltas = self.deltas, {}
+            gauges, self.gauges = self.gauges, {}
+            self.last_flush = now
+
+        with locked_file(f'{self.path}.lock', 'a', encoding='utf-8'):
+            values = {}
+            if os.path.exists(self.path):
+                with io.open(self.path, 'r', encoding='utf-8') as f:
+                    values = self.parse(f.read())
+            for key, value in deltas.items():
+                values[key] = values.get(key, 0) + value
+            values.update(gauges)
+            text = self.render(values)
+            tmp_path = f'{self.path}.tmp'
+            with io.open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        return text
+
+    def serve(self, port, host='127.0.0.1'):
+        registry = self
+
+        class MetricsRequestHandler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                text = registry.flush(force=True) or ''
+                body = text.encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = http.server.ThreadingHTTPServer((host, port), MetricsRequestHandler)
+        thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        thread.start()
+        print(f'[=] Metrics served at: http://{host}:{port}/metrics')
+        return self.server
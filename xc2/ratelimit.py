@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import re
+import time
+
+from .utils import locked_json
+
+
+class HostRateLimiter(object):
+    # Token bucket per host, persisted in the conf dir so every worker
+    # (threads, parallel scripts, other containers sharing the conf dir)
+    # draws from the same budget. Rate is cut on throttling (multiplicative)
+    # and recovers additively on every successful request.
+    # Tokens are drawn per request the crawler sends, but only per process
+    # start for youtube-dl jobs: throttling is only seen from the output tail
+    # once the process exits. Downloads inside one process can be spaced by
+    # an opt-in --sleep-interval (see sleep_interval), a fixed pace that does
+    # not adapt to throttling. A rate <= 0 disables the limiter.
+    STATE_FILE = 'ratelimit.json'
+    MIN_RATE_FLOOR = 0.001
+
+    THROTTLE_PATTERN = re.compile(
+        r'HTTP Error (429|503)|Connection reset by peer|ConnectionResetError|RemoteDisconnected')
+
+    def __init__(self, conf_dir, rate=1.0, burst=3, min_rate=0.05, backoff=0.5, recover=0.02):
+        self.state_path = os.path.join(conf_dir, self.STATE_FILE)
+        self.rate = float(rate)
+        self.enabled = self.rate > 0
+        self.burst = max(1.0, float(burst))
+        self.min_rate = max(self.MIN_RATE_FLOOR, min(float(min_rate), self.rate))
+        self.backoff = float(backoff)
+        self.recover = float(recover)
+
+    def _bucket(self, state, host, now):
+        bucket = state.get(host)
+        if bucket is None:
+            bucket = {'rate': self.rate, 'tokens': self.burst, 'ts': now}
+            state[host] = bucket
+        # the configured rate may have been lowered since the state was saved
+        bucket['rate'] = max(self.min_rate, min(bucket['rate'], self.rate))
+        elapsed = max(0.0, now - bucket['ts'])
+        bucket['tokens'] = min(self.burst, bucket['tokens'] + elapsed * bucket['rate'])
+        bucket['ts'] = now
+        return bucket
+
+    def acquire(self, host):
+        if not self.enabled:
+            return 0.0
+        waited = 0.0
+        while True:
+            now = time.time()
+            with locked_json(self.state_path) as state:
+                bucket = self._bucket(state.data, host, now)
+                if bucket['tokens'] >= 1.0:
+                    bucket['tokens'] -= 1.0
+                    return waited
+                wait = (1.0 - bucket['tokens']) / bucket['rate']
+            time.sleep(wait)
+            waited += wait
+
+    def report(self, host, throttled=False):
+        if not self.enabled:
+            return 0.0
+        with locked_json(self.state_path) as state:
+            bucket = self._bucket(state.data, host, time.time())
+            if throttled:
+                bucket['rate'] = max(self.min_rate, bucket['rate'] * self.backoff)
+                bucket['tokens'] = min(bucket['tokens'], 0.0)
+                print(f'[X] Throttled by {host}, rate --> {bucket["rate"]:.3f}/s')
+            else:
+                bucket['rate'] = min(self.rate, bucket['rate'] + self.recover)
+            return bucket['rate']
+
+    @classmethod
+    def is_throttled(self, output):
+        return self.THROTTLE_PATTERN.search(output) is not None
+
+    @classmethod
+    def sleep_interval(self, rate, concurrency=1):
+        # seconds between the downloads of one youtube-dl process, so that
+        # concurrency processes together stay at rate; None if unlimited
+        if rate <= 0:
+            return None
+        return max(1, concurrency) / rate
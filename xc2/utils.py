@@ -5,6 +5,10 @@ from __future__ import unicode_literals
 
 import os
 import io
+import copy
+import json
+import heapq
+import tempfile
 
 try:
     import fcntl
@@ -54,14 +58,107 @@ class locked_file(object):
     def read(self, *args):
         return self.f.read(*args)
 
+class locked_json(object):
+    # JSON state file shared between processes, guarded by a sidecar lock file
+    def __init__(self, filename, default=None):
+        self.filename = filename
+        self.default = {} if default is None else default
+        self.data = None
+        self.lock = None
+
+    def __enter__(self):
+        self.lock = locked_file(f'{self.filename}.lock', 'a', encoding='utf-8').__enter__()
+        try:
+            with io.open(self.filename, 'r', encoding='utf-8') as f:
+                self.data = json.load(f)
+        except (IOError, ValueError):
+            self.data = copy.deepcopy(self.default)
+        return self
+
+    def __exit__(self, etype, value, traceback):
+        try:
+            if etype is None:
+                tmp_path = f'{self.filename}.tmp'
+                with io.open(tmp_path, 'w', encoding='utf-8') as f:
+                    json.dump(self.data, f)
+                os.replace(tmp_path, self.filename)
+        finally:
+            self.lock.__exit__(etype, value, traceback)
+
 def read_plain_urls(path):
     if not os.path.exists(path):
         return []
     with locked_file(path, 'r', encoding='utf-8') as f:
         return f.read().splitlines()
 
+def iter_plain_urls(path):
+    if not os.path.exists(path):
+        return
+    with locked_file(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if len(line) > 0:
+                yield line
+
+def is_sorted_urls(path):
+    last = None
+    for url in iter_plain_urls(path):
+        if last is not None and url <= last:
+            return False
+        last = url
+    return True
+
+def merge_unique(*iterables):
+    # k-way merge of sorted inputs, dropping repeats on the fly
+    last = None
+    for line in heapq.merge(*iterables):
+        if line != last:
+            yield line
+            last = line
+
+def iter_sorted_unique(lines, run_size=100000, tmp_dir=None):
+    # external sort: sorted runs of at most run_size lines are spilled to
+    # temp files and merged back, so memory stays bounded by run_size
+    runs = []
+    buf = set()
+    try:
+        for line in lines:
+            buf.add(line)
+            if len(buf) >= run_size:
+                fd, run_path = tempfile.mkstemp(prefix='xc2run_', suffix='.txt', dir=tmp_dir)
+                runs.append(run_path)
+                with io.open(fd, 'w', encoding='utf-8') as f:
+                    for run_line in sorted(buf):
+                        f.write(f'{run_line}\n')
+                buf = set()
+        if len(runs) <= 0:
+            for line in sorted(buf):
+                yield line
+            return
+        files = [io.open(run_path, 'r', encoding='utf-8') for run_path in runs]
+        try:
+            for line in merge_unique(sorted(buf), *[(line.rstrip('\n') for line in f) for f in files]):
+                yield line
+        finally:
+            for f in files:
+                f.close()
+    finally:
+        for run_path in runs:
+            os.remove(run_path)
+
 def write_plain_urls(urls, file):
     with locked_file(file, 'w', encoding='utf-8') as f:
         # f.writelines(urls)
         for url in urls:
-            f.write(f'{url}\n')
\ No newline at end of file
+            f.write(f'{url}\n')
+
+def merge_plain_urls(urls, file):
+    # read-modify-write under one lock, so concurrent writers add up
+    with locked_file(f'{file}.lock', 'a', encoding='utf-8'):
+        merged = set(read_plain_urls(file))
+        merged.update(urls)
+        # stray whitespace and blank lines get cleaned on every rewrite
+        merged = set(url.strip() for url in merged)
+        merged.discard('')
+        write_plain_urls(merged, file)
+    return merged
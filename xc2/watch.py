@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+# coding: utf-8
+
+from __future__ import unicode_literals
+
+import os
+import time
+import select
+import ctypes
+import ctypes.util
+
+IN_MODIFY = 0x00000002
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+
+
+class ChangeNotifier(object):
+    # inotify through libc where available, plain polling otherwise
+    def __init__(self, dirs, poll_interval=1.0):
+        self.poll_interval = poll_interval
+        self.fd = None
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+            for dir in dirs:
+                mask = IN_MODIFY | IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE
+                if libc.inotify_add_watch(fd, os.fsencode(dir), mask) < 0:
+                    os.close(fd)
+                    raise OSError(ctypes.get_errno(), f'inotify_add_watch failed: {dir}')
+            self.fd = fd
+        except (OSError, AttributeError, TypeError) as e:
+            print(f'[=] inotify not available, polling every {poll_interval}s: {e}')
+
+    @property
+    def mode(self):
+        return 'inotify' if self.fd is not None else 'polling'
+
+    def wait(self, timeout=None):
+        timeout = self.poll_interval if timeout is None else timeout
+        if self.fd is None:
+            time.sleep(timeout)
+            return True
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        try:
+            while os.read(self.fd, 65536):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+class FileTailer(object):
+    # yields lines appended since the last poll; a truncated, replaced or
+    # rewritten file is re-read and diffed against the lines already seen
+    MARK_SIZE = 64
+
+    def __init__(self, path):
+        self.path = path
+        self.offset = 0
+        self.inode = None
+        # bytes just before offset, to tell an append from a rewrite in place
+        self.mark = b''
+        self.known = set()
+
+    def _read_all(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+                st = os.fstat(f.fileno())
+        except IOError:
+            return []
+        end = data.rfind(b'\n') + 1
+        self.offset = end
+        self.inode = st.st_ino
+        self.mark = data[max(0, end - self.MARK_SIZE):end]
+        return data[:end].decode('utf-8', errors='replace').splitlines()
+
+    def skip_to_end(self):
+        self.known.update(line.strip() for line in self._read_all())
+
+    def mark_known(self, lines):
+        self.known.update(line.strip() for line in lines)
+
+    def poll(self):
+        try:
+            st = os.stat(self.path)
+        except OSError:
+            return []
+        if st.st_ino != self.inode or st.st_size < self.offset:
+            lines = self._read_all()
+        elif st.st_size > self.offset:
+            with open(self.path, 'rb') as f:
+                f.seek(self.offset - len(self.mark))
+                data = f.read()
+            if not data.startswith(self.mark):
+                lines = self._read_all()
+            else:
+                data = data[len(self.mark):]
+                end = data.rfind(b'\n') + 1
+                self.offset += end
+                self.mark = (self.mark + data[:end])[-self.MARK_SIZE:]
+                lines = data[:end].decode('utf-8', errors='replace').splitlines()
+        else:
+            return []
+
+        new_lines = []
+        for line in lines:
+            line = line.strip()
+            if len(line) > 0 and line not in self.known:
+                self.known.add(line)
+                new_lines.append(line)
+        return new_lines
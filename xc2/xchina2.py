@@ -2,22 +2,51 @@
 
 import os
 import sys
+import copy
+import time
 import queue
 import datetime
 import urllib.parse
+import http.client
 import collections
 import errno
 import json
+import shlex
+import tempfile
 
 from .utils import (
     locked_file,
     read_plain_urls,
-    write_plain_urls
+    write_plain_urls,
+    merge_plain_urls,
+    iter_plain_urls,
+    is_sorted_urls,
+    merge_unique,
+    iter_sorted_unique
+)
+from .ratelimit import HostRateLimiter
+from .failures import FailureJournal
+from .archive_index import ArchiveIndex
+from .metrics import MetricsRegistry
+from .catalog import MediaCatalog
+from .costmodel import CostModel
+from .crawler import ListCrawler
+from .delta import DeltaExporter
+from .diskspace import (
+    DiskAdmission,
+    SizeEstimator
+)
+from .executor import (
+    DownloadJob,
+    DownloadResult,
+    DownloadExecutor
+)
+from .watch import (
+    ChangeNotifier,
+    FileTailer
 )
 
 THIS_CMD = 'xchina2'
-DOWNLOAD_COMMON_ARG = ''
-ABCM = 5
 
 SourceParam = collections.namedtuple(
     'SourceParam', ['sid', 'extractor', 'output_template', 'url_format', 'todo_urls'])
@@ -26,23 +55,25 @@ sp_xc_p = SourceParam(
     extractor='xchinaphoto',
     output_template='%(uploader)s/%(playlist_title)s-%(playlist_id)s/%(title)s.%(ext)s',
     url_format='https://xchina.co/photo/id-%s.html',
-    todo_urls={},
+    todo_urls=None,
 )
 sp_xc_v = SourceParam(
     sid='xc_v',
     extractor='xchinavideo',
     output_template='%(uploader)s/%(title)s-%(id)s.%(ext)s',
     url_format='https://xchina.co/video/id-%s.html',
-    todo_urls={},
+    todo_urls=None,
 )
 sp_xbbs = SourceParam(
     sid='xbbs',
     extractor='xbbsthread',
     output_template='%(playlist_title)s/%(playlist_index)s-%(playlist_id)s.%(ext)s',
     url_format='https://xbbs.me/thread/id-%s.html',
-    todo_urls={},
+    todo_urls=None,
 )
 
+# source templates, read-only: every XchinaSession plans on its own copies
+# with todo_urls of their own, see XchinaSession.new_sources
 MySource = collections.namedtuple('MySource', ['xc_p', 'xc_v', 'xbbs'])
 mySource = MySource(
     xc_p=sp_xc_p,
@@ -51,48 +82,46 @@ mySource = MySource(
 )
 
 class ConfigHandler(object):
-    ROOT_DIR = './'
     LISTS_FILE = 'lists.txt'
     ITEMS_FILE = 'items.txt'
     FAILED_FILE = 'failed.txt'
+    DROPIN_DIR = 'dropin'
 
     @classmethod
-    def setRootDir(self, root_dir='.'):
-        self.ROOT_DIR = os.path.abspath(root_dir)
-        print(f'[===] Config.root_dir changed to: {self.ROOT_DIR}')
-
-    @classmethod
-    def getBinDir(self, work_dir=None):
-        if not work_dir:
-            work_dir = self.ROOT_DIR
+    def getBinDir(self, work_dir):
         bin_dir = os.path.join(work_dir, 'bin')
         if not os.path.exists(bin_dir):
             os.makedirs(bin_dir)
         return bin_dir
 
     @classmethod
-    def getConfDir(self, work_dir=None):
-        if not work_dir:
-            work_dir = self.ROOT_DIR
+    def getConfDir(self, work_dir):
         conf_dir = os.path.join(work_dir, 'conf')
         if not os.path.exists(conf_dir):
             os.makedirs(conf_dir)
         return conf_dir
 
     @classmethod
-    def getListsFile(self, work_dir=None):
+    def getListsFile(self, work_dir):
         conf_dir = self.getConfDir(work_dir)
         return os.path.join(conf_dir, self.LISTS_FILE)
     
     @classmethod
-    def getItemsFile(self, work_dir=None):
+    def getItemsFile(self, work_dir):
         conf_dir = self.getConfDir(work_dir)
         return os.path.join(conf_dir, self.ITEMS_FILE)
     
     @classmethod
-    def getFailedFile(self, work_dir=None):
+    def getFailedFile(self, work_dir):
         conf_dir = self.getConfDir(work_dir)
         return os.path.join(conf_dir, self.FAILED_FILE)
+
+    @classmethod
+    def getDropinDir(self, work_dir):
+        dropin_dir = os.path.join(self.getConfDir(work_dir), self.DROPIN_DIR)
+        if not os.path.exists(dropin_dir):
+            os.makedirs(dropin_dir)
+        return dropin_dir
     
 class XchinaParser(object):
 
@@ -186,39 +215,84 @@ class PlaylistArchiveHandler(object):
                 ret.append(os.path.join(dir, file))
         return ret
 
+    @classmethod
+    def write_sorted_urls(self, urls, output_path):
+        # streamed to a temp file and renamed, readers never see a partial file
+        counter = collections.Counter()
+        def count(urls):
+            for url in urls:
+                counter['urls'] += 1
+                yield url
+        # a unique temp name, other builders may be writing next to it
+        fd, tmp_path = tempfile.mkstemp(prefix=f'.{os.path.basename(output_path)}.', suffix='.tmp', dir=os.path.dirname(output_path))
+        os.close(fd)
+        try:
+            write_plain_urls(count(urls), tmp_path)
+            os.replace(tmp_path, output_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return counter['urls']
+
     @classmethod
     def do_generate_playlist_archive_file(self, input_path, output_path, prefix, url_format):
         if not os.path.exists(input_path):
             print(f'[X] Input path not exists: {input_path}')
             return 0
         
-        outputs = []
-        try:
-            with locked_file(input_path, 'r', encoding='utf-8') as input:
-                last = ''
-                for line in input:
-                    if line.startswith(prefix):
-                        cid = line[len(prefix)+1:].strip().replace('\\n', '')
-                        index = cid.find('_')
-                        if index > 0:
-                            cid = cid[:index]
-                        if cid != last:
-                            outputs.append(url_format % (cid))
+        def iter_input_urls():
+            try:
+                with locked_file(input_path, 'r', encoding='utf-8') as input:
+                    last = ''
+                    for line in input:
+                        cid = self.parse_archive_id(line, prefix)
+                        if cid is not None and cid != last:
+                            yield url_format % (cid)
                             last = cid
-        except IOError as ioe:
-            if ioe.errno != errno.ENOENT:
-                raise
-        write_plain_urls(set(outputs), f'{output_path}.curr.txt')
-
-        sub_files = self.list_playlist_archive_series_files(output_path)
-        # print(sub_files)
-        for file in sub_files:
-            outputs.extend(read_plain_urls(file))
-
-        outputs = set(outputs)
-        write_plain_urls(outputs, output_path)
-        
-        return len(outputs)
+            except IOError as ioe:
+                if ioe.errno != errno.ENOENT:
+                    raise
+        tmp_dir = os.path.dirname(output_path)
+        curr_path = f'{output_path}.curr.txt'
+        # `xchina2 playlist` runs from parallel scripts, one build at a time
+        with locked_file(f'{output_path}.lock', 'a', encoding='utf-8'):
+            self.write_sorted_urls(iter_sorted_unique(iter_input_urls(), tmp_dir=tmp_dir), curr_path)
+
+            # series files are kept sorted so every input is a sorted run
+            sub_files = self.list_playlist_archive_series_files(output_path)
+            for file in sub_files:
+                if not is_sorted_urls(file):
+                    print(f'[=] Sorting playlist archive series file: {file}')
+                    self.write_sorted_urls(iter_sorted_unique(iter_plain_urls(file), tmp_dir=tmp_dir), file)
+
+            cnt = self.write_sorted_urls(
+                merge_unique(*[iter_plain_urls(file) for file in [curr_path] + sub_files]),
+                output_path)
+            ArchiveIndex.write(
+                ArchiveIndex.get_index_path(output_path),
+                (cid for cid in (self.get_url_id(url, url_format) for url in iter_plain_urls(output_path)) if cid),
+                tmp_dir=tmp_dir)
+
+        return cnt
+
+    @classmethod
+    def parse_archive_id(self, line, prefix):
+        # "xchinaphoto 111_1" --> "111", entries of a playlist share its id
+        if not line.startswith(prefix):
+            return None
+        cid = line[len(prefix)+1:].strip().replace('\\n', '')
+        index = cid.find('_')
+        if index > 0:
+            cid = cid[:index]
+        return cid
+
+    @classmethod
+    def get_url_id(self, url, url_format):
+        prefix, suffix = url_format.split('%s', 1)
+        if url.startswith(prefix) and url.endswith(suffix) and len(url) > len(prefix) + len(suffix):
+            return url[len(prefix):len(url)-len(suffix)]
+        return None
 
     @classmethod
     def get_source_archive_path(self, root_path, source_id):
@@ -243,6 +317,10 @@ class PlaylistArchiveHandler(object):
             print(
                 f'[+] Generated - {param.sid} : {cnt} --> {self.get_playlist_archive_path(path, param.sid)}')
 
+    @classmethod
+    def open_playlist_archive_index(self, root_path, source_id):
+        return ArchiveIndex(ArchiveIndex.get_index_path(self.get_playlist_archive_path(root_path, source_id)))
+
     @classmethod
     def get_playlist_archive_urlparam(self, root_path, source_id):
         archive_path = self.get_playlist_archive_path(root_path, source_id)
@@ -251,6 +329,7 @@ class PlaylistArchiveHandler(object):
         })
 
 class DownloadHandler(object):
+    USER_AGENT = 'Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:105.0) Gecko/20100101 Firefox/105.0'
 
     @classmethod
     def generate_download_item(self,
@@ -274,13 +353,16 @@ class DownloadHandler(object):
             referer=None,
             archive=None,
             download_arg_common=None,
-            download_args=None):
-        if not output_template or not url:
+            download_args=None,
+            stderr_file=None,
+            batch_file=None,
+            stdout_file=None):
+        if not output_template or not (url or batch_file):
             return 'echo "param err, continue..."\n'
         cmd = f'youtube-dl' \
-            + f' "{url}"' \
+            + (f' --batch-file "{batch_file}" --ignore-errors' if batch_file else f' "{url}"') \
             + f' --no-progress' \
-            + f' --user-agent "Mozilla/5.0 (Macintosh; Intel Mac OS X 10.15; rv:105.0) Gecko/20100101 Firefox/105.0"' \
+            + f' --user-agent "{self.USER_AGENT}"' \
             + f' -o "{output_template}"' \
             + (f' --referer "{referer}"' if referer else '') \
             + (f' --download-archive "{archive}"' if archive else '') \
@@ -289,9 +371,85 @@ class DownloadHandler(object):
         if download_args:
             for arg in download_args:
                 cmd = cmd + f' {arg}'
-        cmd = cmd + ' $@ \n'
+        cmd = cmd + ' $@' + (f' 2>"{stderr_file}"' if stderr_file else '') \
+            + (f' | tee "{stdout_file}"' if stdout_file else '') + ' \n'
         return cmd
 
+    @classmethod
+    def generate_download_argv(
+            self,
+            url,
+            output_template,
+            referer=None,
+            archive=None,
+            download_arg_common=None,
+            download_args=None):
+        argv = ['youtube-dl', url, '--no-progress', '--user-agent', self.USER_AGENT, '-o', output_template]
+        if referer:
+            argv.extend(['--referer', referer])
+        if archive:
+            argv.extend(['--download-archive', archive])
+        if download_arg_common:
+            argv.extend(shlex.split(download_arg_common))
+        if download_args:
+            for arg in download_args:
+                argv.extend(shlex.split(arg))
+        return argv
+
+    @classmethod
+    def generate_source_cmd_params(self, root_path, source, download_archive_path=None, download_arg_common=None, conf_path=None):
+        conf_path = conf_path or ConfigHandler.getConfDir(root_path)
+        param_referer = XchinaParser.parse_referer(source.url_format)
+        param_download_archive = PlaylistArchiveHandler.get_source_archive_path(conf_path, source.sid) if not download_archive_path else download_archive_path
+        # longest first by the durations learned from past runs
+        cost_model = CostModel(conf_path)
+        todo_urls = source.todo_urls
+        ret = []
+        for key in sorted(todo_urls.keys()):
+            item = todo_urls[key]
+            cost, _ = cost_model.estimate(source.sid, key)
+            ret.append((key, {
+                'url': item.get('url', None),
+                'output_template': item.get('ot', f'{root_path}/{source.sid}/{source.output_template}'),
+                'referer': param_referer,
+                'archive': param_download_archive,
+                'download_arg_common': download_arg_common,
+                'download_args': item.get('args', None),
+            }, cost))
+        ret.sort(key=lambda param: param[2], reverse=True)
+        return ret
+
+    @classmethod
+    def generate_download_job(self, source, key, cmd_param, update_pl_archive=True, record_failures=True):
+        if not cmd_param['url'] or not cmd_param['output_template']:
+            return None
+        return DownloadJob(
+            sid=source.sid,
+            key=key if record_failures else None,
+            url=cmd_param['url'],
+            argv=self.generate_download_argv(**cmd_param),
+            host=cmd_param['referer'],
+            update_pl_archive=update_pl_archive,
+        )
+
+    @classmethod
+    def generate_download_jobs(self,
+                            root_path,
+                            sources,
+                            download_archive_path=None,
+                            update_pl_archive=True,
+                            download_arg_common=None,
+                            record_failures=True,
+                            conf_path=None):
+        jobs = []
+        for source in sources:
+            for key, cmd_param, cost in self.generate_source_cmd_params(root_path, source, download_archive_path, download_arg_common, conf_path):
+                job = self.generate_download_job(source, key, cmd_param, update_pl_archive, record_failures)
+                if job:
+                    jobs.append((cost, job))
+        jobs.sort(key=lambda cost_job: cost_job[0], reverse=True)
+        return [job for cost, job in jobs]
+
     @classmethod
     def generate_bin_scripts(self,
                             root_path, 
@@ -299,43 +457,57 @@ class DownloadHandler(object):
                             download_archive_path=None, 
                             update_pl_archive=True, 
                             script_name_prefix='run',
-                            download_arg_common=None):
+                            download_arg_common=None,
+                            record_failures=True,
+                            shards=1,
+                            conf_path=None,
+                            bin_path=None,
+                            this_cmd=THIS_CMD,
+                            script_jobs=None,
+                            recent_only=None):
         # generate scripts
         print(f'[==] Generating exe scripts:')
         # file_suffix = int(datetime.datetime.timestamp(datetime.datetime.utcnow()))
         file_suffix = datetime.datetime.now().strftime("%y%j-%H%M%S")
-        bin_path = ConfigHandler.getBinDir()
+        bin_path = bin_path or ConfigHandler.getBinDir(root_path)
         script_paths = []
 
         # this_file_path = os.path.abspath(__file__)
         
         for source in sources:
-            if len(source.todo_urls) > 0:
-                param_referer = XchinaParser.parse_referer(source.url_format)
-                param_download_archive = PlaylistArchiveHandler.get_source_archive_path(ConfigHandler.getConfDir(), source.sid) if not download_archive_path else download_archive_path
-                script_filename = f'{script_name_prefix}_{source.sid}_{file_suffix}.sh'
+            if len(source.todo_urls) <= 0:
+                continue
+            all_cmd_params = self.generate_source_cmd_params(root_path, source, download_archive_path, download_arg_common, conf_path)
+            # balanced by estimated duration, one script per parallel worker
+            shard_cmd_params = CostModel.split_balanced(all_cmd_params, shards, cost=lambda param: param[2])
+            for shard, cmd_params in enumerate(shard_cmd_params):
+                shard_suffix = f'_s{shard+1}' if len(shard_cmd_params) > 1 else ''
+                script_filename = f'{script_name_prefix}_{source.sid}_{file_suffix}{shard_suffix}.sh'
                 script_path = os.path.join(bin_path, script_filename)
                 script_paths.append(script_path)
+                jobs = []
                 with open(script_path, 'w') as f:
                     f.write('#!/bin/bash\n\nset -x\n\n')
+                    if record_failures:
+                        f.write('XC2_ERR=$(mktemp)\nXC2_OUT=$(mktemp)\ntrap \'rm -f "$XC2_ERR" "$XC2_OUT"\' EXIT\n\n')
                     cnt = 1
-                    #sort to place 'series-' urls before 'model-' to speed up list updating
-                    todo_urls = source.todo_urls
-                    keys = list(todo_urls.keys())
-                    keys.sort(reverse=False)
-                    # sorted_urls = {i: todo_urls[i] for i in keys}
-                    for key in keys:
-                        item = todo_urls[key]
-                        f.write(f'echo -e "\\033]0;{script_filename}:[{cnt}/{len(todo_urls)}]\\007"\n')
+                    for key, cmd_param, cost in cmd_params:
+                        f.write(f'echo -e "\\033]0;{script_filename}:[{cnt}/{len(cmd_params)}]\\007"\n')
+                        if record_failures:
+                            f.write('XC2_START=$SECONDS\n')
                         cmd = self.generate_download_cmd(
-                            url=item.get('url', None),
-                            output_template=item.get('ot', f'{root_path}/{source.sid}/{source.output_template}'),
-                            referer=param_referer,
-                            archive=param_download_archive,
-                            download_arg_common=download_arg_common,
-                            download_args=item.get('args', None)
-                        )
+                            stderr_file='$XC2_ERR' if record_failures else None,
+                            stdout_file='$XC2_OUT' if record_failures else None, **cmd_param)
                         f.write(cmd)
+                        if record_failures:
+                            # outcome, duration and files written go back to the journal and cost model
+                            f.write('XC2_RC=${PIPESTATUS[0]}; cat "$XC2_ERR" >&2\n')
+                            mode_arg = f' {int(recent_only)}' if recent_only is not None else ''
+                            f.write(f'if [ $XC2_RC -eq 0 ]; then xchina2 done {source.sid} "{key}" $((SECONDS - XC2_START)) "$XC2_OUT"; '
+                                    f'else xchina2 failure {source.sid} "{key}" "$XC2_ERR"{mode_arg}; fi \n')
+                        job = self.generate_download_job(source, key, cmd_param, update_pl_archive, record_failures)
+                        if job:
+                            jobs.append(job)
                         if update_pl_archive:
                             f.write(f'xchina2 playlist {source.sid} \n')
                         f.write('\n')
@@ -343,115 +515,88 @@ class DownloadHandler(object):
                     f.flush()
                     
                     f.write(f'echo -e "\\033]0;{script_filename}:[finished]\\007"\n')
-                    f.write(f'\necho "Finished!!\nGenerated by: {THIS_CMD}" \n')
-                print(f'[+] {source.sid}: {len(source.todo_urls)} --> {script_path}')
+                    f.write(f'\necho "Finished!!\nGenerated by: {this_cmd}" \n')
+                if script_jobs is not None:
+                    script_jobs[script_path] = jobs
+                estimated = sum(param[2] for param in cmd_params)
+                print(f'[+] {source.sid}: {len(cmd_params)} (est. {int(estimated)}s) --> {script_path}')
 
         print(f'[=] Scripts generated: {len(script_paths)}')
         for sp in script_paths:
             print(f'bash {sp}')
         return script_paths
 
-def sync_urls(urls, work_dir, recent_only=False):
-    print(f'[==] Syncing urls with work dir: {work_dir}')
-
-    ROOT_XCHINA = 'https://xchina.co/'
-    ROOT_XBBS = 'https://xbbs.me/'
-
-    lists_path = ConfigHandler.getListsFile()
-    items_path = ConfigHandler.getItemsFile()
-    config_dir = ConfigHandler.getConfDir()
-    # load urls
-    LISTS_URLS = read_plain_urls(lists_path)
-    ITEMS_URLS = read_plain_urls(items_path)
-    write_plain_urls(LISTS_URLS, f'{lists_path}.bak')
-    write_plain_urls(ITEMS_URLS, f'{items_path}.bak')
-    print(f'[=] Read lists from "{lists_path}": {len(LISTS_URLS)}')
-    print(f'[=] Read items from "{items_path}": {len(ITEMS_URLS)}')
-
-    lists = []
-    items = []
-    for list in LISTS_URLS:
-        XchinaParser.append_url_to_list(lists, list, list)
-    for item in ITEMS_URLS:
-        XchinaParser.append_url_to_list(items, item, item)
-
-    # init todo queue
-    todo_failed = []
-    todo = queue.Queue()
-    for url in urls:
-        todo.put(url)
-
-    # handle every url in todo queue
-    while not todo.empty():
-        url = todo.get()
-        if url.startswith(ROOT_XCHINA):
-            url_r = url[len(ROOT_XCHINA):]
-            if url_r.startswith('model/'):
-                model_id = XchinaParser.get_model_id(url)
-                p_url, v_url = XchinaParser.get_model_pv_urls(model_id)
-                todo.put(p_url)
-                todo.put(v_url)
-            else:
-                paged_urls = XchinaParser.extract_page_end(url)
-                model_id, model_url = XchinaParser.get_model_id_url(url)
-                if url_r.startswith('photos/'):
-                    todo_url = paged_urls[1] if recent_only else paged_urls[2]
-                    sp_xc_p.todo_urls[todo_url] = DownloadHandler.generate_download_item(
-                            f'{todo_url}?{PlaylistArchiveHandler.get_playlist_archive_urlparam(config_dir, sp_xc_p.sid)}'
-                            + (f'&abcm={ABCM}' if recent_only else '')
-                        )
-                    XchinaParser.append_url_to_list(lists, model_url, paged_urls[1])
-                elif url_r.startswith('videos/'):
-                    todo_url = paged_urls[1] if recent_only else paged_urls[2]
-                    sp_xc_v.todo_urls[todo_url] = DownloadHandler.generate_download_item(
-                            f'{todo_url}?{PlaylistArchiveHandler.get_playlist_archive_urlparam(config_dir, sp_xc_v.sid)}'
-                        )
-                    XchinaParser.append_url_to_list(lists, model_url, paged_urls[1])
-                elif url_r.startswith('photo/'):
-                    sp_xc_p.todo_urls[paged_urls[1]] = DownloadHandler.generate_download_item(
-                            paged_urls[1]
-                        )
-                    XchinaParser.append_url_to_list(items, None, paged_urls[1])
-                elif url_r.startswith('video/'):
-                    sp_xc_v.todo_urls[paged_urls[1]] = DownloadHandler.generate_download_item(
-                            paged_urls[1]
-                        )
-                    XchinaParser.append_url_to_list(items, None, paged_urls[1])
-                else:
-                    todo_failed.append(url)
-                    print(f'[X] Unsupported "{ROOT_XCHINA}" URL: {url}')
-        elif url.startswith(ROOT_XBBS):
-            url_r = url[len(ROOT_XBBS):]
-            paged_urls = XchinaParser.extract_page_end(url)
-            if url_r.startswith('thread/'):
-                sp_xbbs.todo_urls[paged_urls[1]] = DownloadHandler.generate_download_item(
-                       paged_urls[1]
-                    )
-                XchinaParser.append_url_to_list(items, None, paged_urls[1])
-            elif url_r.startswith('forum/') or url_r.startswith('user/'):
-                todo_url = paged_urls[1] if recent_only else paged_urls[2]
-                sp_xbbs.todo_urls[todo_url] = DownloadHandler.generate_download_item(
-                       f'{todo_url}?{XchinaParser.get_playlist_archive_urlparam(config_dir, sp_xbbs.sid)}'
-                    )
-                XchinaParser.append_url_to_list(lists, None, paged_urls[1])
-            else:
-                todo_failed.append(url)
-                print(f'[X] Unsupported "{ROOT_XBBS}" URL: {url}')
-        else:
-            todo_failed.append(url)
-            print(f'[X] Unsupported URL: {url}')
+    @classmethod
+    def generate_batch_scripts(self,
+                            root_path,
+                            sources,
+                            chunks=4,
+                            download_archive_path=None,
+                            update_pl_archive=True,
+                            script_name_prefix='batch',
+                            download_arg_common=None,
+                            conf_path=None,
+                            bin_path=None,
+                            this_cmd=THIS_CMD,
+                            recent_only=None):
+        # one long-lived youtube-dl per chunk of URLs, chunks run in parallel
+        print(f'[==] Generating batch exe scripts, chunks: {chunks}')
+        file_suffix = datetime.datetime.now().strftime("%y%j-%H%M%S")
+        bin_path = bin_path or ConfigHandler.getBinDir(root_path)
+        script_paths = []
 
-    print('[==] Sync finished!')
+        for source in sources:
+            if len(source.todo_urls) <= 0:
+                continue
+            # items sharing output template and args can share a process
+            groups = collections.OrderedDict()
+            for key, cmd_param, cost in self.generate_source_cmd_params(root_path, source, download_archive_path, download_arg_common, conf_path):
+                if not cmd_param['url'] or not cmd_param['output_template']:
+                    continue
+                group_key = (cmd_param['output_template'], tuple(cmd_param['download_args'] or ()))
+                groups.setdefault(group_key, []).append((key, cmd_param, cost))
+
+            script_filename = f'{script_name_prefix}_{source.sid}_{file_suffix}.sh'
+            script_path = os.path.join(bin_path, script_filename)
+            script_paths.append(script_path)
+            with open(script_path, 'w') as f:
+                f.write('#!/bin/bash\n\nset -x\n\n')
+                batch_cnt = 0
+                for group in groups.values():
+                    for chunk in CostModel.split_balanced(group, chunks, cost=lambda param: param[2]):
+                        batch_cnt += 1
+                        batch_file = os.path.join(bin_path, f'{script_name_prefix}_{source.sid}_{file_suffix}_{batch_cnt}.txt')
+                        write_plain_urls([cmd_param['url'] for key, cmd_param, cost in chunk], batch_file)
+                        # journal keys of the chunk, for what is still missing if it fails
+                        keys_file = f'{batch_file[:batch_file.rfind(".")]}.keys.txt'
+                        write_plain_urls([key for key, cmd_param, cost in chunk], keys_file)
+                        cmd_param = dict(chunk[0][1], url=None)
+                        f.write('(\n')
+                        f.write('XC2_ERR=$(mktemp)\nXC2_OUT=$(mktemp)\ntrap \'rm -f "$XC2_ERR" "$XC2_OUT"\' EXIT\n')
+                        f.write(f'echo -e "\\033]0;{script_filename}:[chunk {batch_cnt}: {len(chunk)}]\\007"\n')
+                        f.write('XC2_START=$SECONDS\n')
+                        f.write(self.generate_download_cmd(batch_file=batch_file, stderr_file='$XC2_ERR', stdout_file='$XC2_OUT', **cmd_param))
+                        f.write('XC2_RC=${PIPESTATUS[0]}; cat "$XC2_ERR" >&2\n')
+                        mode_arg = f' {int(recent_only)}' if recent_only is not None else ''
+                        f.write(f'if [ $XC2_RC -eq 0 ]; then xchina2 batch-done {source.sid} "{keys_file}" $((SECONDS - XC2_START)) "$XC2_OUT"; '
+                                f'else xchina2 batch-failure {source.sid} "{keys_file}" "$XC2_ERR"{mode_arg}; fi \n')
+                        f.write(') &\n\n')
+                    # chunks of the next group may depend on the lists updated by this one,
+                    # refreshed once all chunks are done instead of concurrently per chunk
+                    f.write('wait\n')
+                    if update_pl_archive:
+                        f.write(f'xchina2 playlist {source.sid} \n')
+                    f.write('\n')
+                f.flush()
 
-    # save URLs
-    set_lists = set(lists)
-    set_items = set(items)
-    write_plain_urls(set_lists, lists_path)
-    write_plain_urls(set_items, items_path)
-    print(f'[+] Saved lists: {len(set_lists)} (+{len(set_lists) - len(LISTS_URLS)}) --> {lists_path}')
-    print(f'[+] Saved items: {len(set_items)} (+{len(set_items) - len(ITEMS_URLS)})--> {items_path}')
+                f.write(f'echo -e "\\033]0;{script_filename}:[finished]\\007"\n')
+                f.write(f'\necho "Finished!!\nGenerated by: {this_cmd}" \n')
+            print(f'[+] {source.sid}: {len(source.todo_urls)} in {batch_cnt} chunks --> {script_path}')
 
-    return todo_failed
+        print(f'[=] Scripts generated: {len(script_paths)}')
+        for sp in script_paths:
+            print(f'bash {sp}')
+        return script_paths
 
 def scan_photos(photo_dir='./xc_p'):
     path = os.path.abspath(photo_dir)
@@ -479,6 +624,8 @@ def scan_photos(photo_dir='./xc_p'):
     }
     re_locate_set_prefixs = ['\u56FD\u6A21', '\u53F0\u6A21', '\u6B27\u6A21', '\u6E2F\u6A21', '\u97E9\u6A21', '\u65E5\u6A21']
     img_set_paths = {}
+    # img_set_path --> media files, kept to replay the Stage 1 fixes virtually
+    img_set_views = {}
     print(f'[==] Start scanning photos dir: {path}')
     models = os.listdir(path)
     # print(f'[=] Model dirs found: {len(models)}')
@@ -513,33 +660,30 @@ def scan_photos(photo_dir='./xc_p'):
                 })
 
             img_set_path_name = img_set_path[len(path)+1:]
-            img_set_id = None
-            img_set_ps = 0
-            img_set_vs = 0
-            if img_set.rfind('-') >= 0:
-                img_set_id = img_set[img_set.rfind('-')+1:]
+            img_set_id, img_set_ps, img_set_vs = MediaCatalog.parse_set_name(img_set)
+            if img_set_id is not None:
                 isp = img_set_paths.get(img_set_id, [])
                 isp.append(img_set_path)
                 img_set_paths[img_set_id] = isp
-
-                img_set_left = img_set[:img_set.rfind('-')]
-                if img_set_left.rfind('-') >= 0:
-                    vps = img_set_left[img_set_left.rfind('-')+1:]
-                    if vps.find('P') >= 0:
-                        ps = vps[:vps.find('P')]
-                        img_set_ps = int(ps)
-                        if vps.find('V') >= 0:
-                            vs = vps[vps.find('P')+1:vps.find('V')]
-                            img_set_vs = int(vs)
-                    else:
-                        ret['no_pvs_paths'].append(img_set_path)
-                else:
+                if img_set_ps is None:
                     ret['no_pvs_paths'].append(img_set_path)
             else:
                 ret['no_id_paths'].append(img_set_path)
+            img_set_ps = img_set_ps or 0
+            img_set_vs = img_set_vs or 0
 
             files = os.listdir(img_set_path)
-            if files is None or len(files) <= 0:
+            img_set_view = {
+                'img_set': img_set,
+                'id': img_set_id,
+                'ps': img_set_ps,
+                'vs': img_set_vs,
+                'jpgs': set(),
+                'mp4s': set(),
+                'no_files': files is None or len(files) <= 0,
+            }
+            img_set_views[img_set_path] = img_set_view
+            if img_set_view['no_files']:
                 ret['no_files_paths'].append(img_set_path)
                 continue
 
@@ -571,6 +715,8 @@ def scan_photos(photo_dir='./xc_p'):
                 else:
                     size_map[filesize] = 1
 
+            img_set_view['jpgs'].update(jpgs)
+            img_set_view['mp4s'].update(mp4s)
             if len(exts) > 0:
                 ret['unknown_files'].append(f'UN files in IS:{len(exts)} --> {img_set_path_name}')
                 for ext in exts:
@@ -619,185 +765,733 @@ def scan_photos(photo_dir='./xc_p'):
                     'co': co_v,
                 })
 
-    return ret, fix
+    return ret, fix, img_set_views
+
+def apply_stage1_fixes_virtually(img_set_views, fix):
+    # replay what the Stage 1 scripts will do, in the same order, on the
+    # in-memory view: dup_id_set merges first, then re_locate_set moves
+    views = dict(img_set_views)
+    for todo in fix['dup_id_set']:
+        na = views.pop(todo['na'], None)
+        co = views.get(todo['co'], None)
+        if na and co:
+            co['jpgs'] = co['jpgs'] | na['jpgs']
+            co['mp4s'] = co['mp4s'] | na['mp4s']
+    for todo in fix['re_locate_set']:
+        target_dir = os.path.join(todo['re_locate_path'], todo['img_set'])
+        if todo['img_set_path'] in views and target_dir not in views:
+            views[target_dir] = views.pop(todo['img_set_path'])
+
+    incomp_pvs = []
+    for img_set_path, view in views.items():
+        # empty dirs are reported in no_files_paths, not as incomplete, unless
+        # a merge filled them
+        if view['no_files'] and len(view['jpgs']) + len(view['mp4s']) <= 0:
+            continue
+        if (view['ps'] + view['vs']) > 0:
+            if view['ps'] - len(view['jpgs']) > 1 or view['vs'] != len(view['mp4s']):
+                incomp_pvs.append({
+                    'id': view['id'],
+                    'img_set_path': img_set_path,
+                })
+    return incomp_pvs
+
+class XchinaSession(object):
+    # One planning batch: its config, per-source todo plans and results.
+    # Nothing here is shared with other sessions, so several batches can be
+    # planned in threads of one process and dropped independently.
+    def __init__(self,
+            root_dir='./',
+            work_dir='./',
+            this_cmd=THIS_CMD,
+            download_common_arg='',
+            abcm=5,
+            batch_chunks=0,
+            use_catalog=True,
+            shards=1,
+            native_crawl=0,
+            executor='bash',
+            workers=1,
+            rate=1.0,
+            burst=3,
+            disk_watermark=None,
+            metrics=None):
+        self.root_dir = os.path.abspath(root_dir)
+        self.work_dir = os.path.abspath(work_dir)
+        self.conf_dir = ConfigHandler.getConfDir(self.root_dir)
+        self.this_cmd = this_cmd
+        self.download_common_arg = download_common_arg
+        self.abcm = abcm
+        self.batch_chunks = batch_chunks
+        self.use_catalog = use_catalog
+        self.shards = max(1, shards)
+        self.native_crawl = native_crawl
+        self.executor = executor
+        self.workers = workers
+        self.rate = rate
+        self.burst = burst
+        self.disk_watermark = disk_watermark
+        self.metrics = metrics if metrics is not None else MetricsRegistry(os.path.join(self.conf_dir, MetricsRegistry.METRICS_FILE))
+        self.sources = self.new_sources()
+        # script path --> jobs written to it, for running the plan in-process
+        self.script_jobs = {}
+        self.failed_urls = []
+        self.saved_urls = set()
+        # sync mode of the last plan, failure entries to dispatch when it runs
+        self.recent_only = False
+        self.retry_urls = []
+        # media catalog, refreshed once on first use
+        self.catalog = None
+        self.results = []
 
-def scan(dir='./'):
-    path = os.path.abspath(dir)
+    @classmethod
+    def new_sources(self):
+        return MySource(*[source._replace(todo_urls={}) for source in mySource])
+
+    def fork(self):
+        # same config, empty plans
+        session = copy.copy(self)
+        session.sources = self.new_sources()
+        session.script_jobs = {}
+        session.failed_urls = []
+        session.saved_urls = set()
+        session.retry_urls = []
+        session.catalog = None
+        session.results = []
+        return session
+
+    def get_bin_dir(self):
+        return ConfigHandler.getBinDir(self.root_dir)
+
+    def get_catalog(self):
+        if not self.use_catalog:
+            return None
+        if self.catalog is None:
+            self.catalog = MediaCatalog(self.conf_dir, self.work_dir).refresh()
+        return self.catalog
+
+    def sync_urls(self, urls, recent_only=False):
+        work_dir = self.work_dir
+        print(f'[==] Syncing urls with work dir: {work_dir}')
+
+        ROOT_XCHINA = 'https://xchina.co/'
+        ROOT_XBBS = 'https://xbbs.me/'
+
+        lists_path = ConfigHandler.getListsFile(self.root_dir)
+        items_path = ConfigHandler.getItemsFile(self.root_dir)
+        config_dir = self.conf_dir
+        sources = self.sources
+        # load urls
+        LISTS_URLS = read_plain_urls(lists_path)
+        ITEMS_URLS = read_plain_urls(items_path)
+        write_plain_urls(LISTS_URLS, f'{lists_path}.bak')
+        write_plain_urls(ITEMS_URLS, f'{items_path}.bak')
+        print(f'[=] Read lists from "{lists_path}": {len(LISTS_URLS)}')
+        print(f'[=] Read items from "{items_path}": {len(ITEMS_URLS)}')
+
+        lists = []
+        items = []
+        for list in LISTS_URLS:
+            XchinaParser.append_url_to_list(lists, list, list)
+        for item in ITEMS_URLS:
+            XchinaParser.append_url_to_list(items, item, item)
+
+        planned_before = {source.sid: len(source.todo_urls) for source in sources}
+        synced_lists = []
+
+        # drop items already complete on disk before anything gets planned
+        catalog = self.get_catalog()
+        satisfied = []
+        def plan_item(source, item_url):
+            item_id = PlaylistArchiveHandler.get_url_id(item_url, source.url_format)
+            if catalog and item_id and catalog.is_satisfied(source.sid, item_id):
+                satisfied.append(item_url)
+                return
+            source.todo_urls[item_url] = DownloadHandler.generate_download_item(item_url)
+
+        # expand list URLs here instead of in a youtube-dl process per list
+        crawler = None
+        if self.native_crawl > 0:
+            crawler = ListCrawler(self.native_crawl, HostRateLimiter(config_dir, rate=self.rate, burst=self.burst), DownloadHandler.USER_AGENT)
+        archive_indexes = {}
+        def crawl_list(source, todo_url, paged_urls):
+            if crawler is None:
+                return False
+            def is_archived(item_id):
+                index = archive_indexes[source.sid]
+                return item_id in index or (catalog is not None and catalog.is_satisfied(source.sid, item_id))
+            number = todo_url[todo_url.rfind('/')+1:todo_url.rfind('.')]
+            try:
+                if source.sid not in archive_indexes:
+                    archive_indexes[source.sid] = PlaylistArchiveHandler.open_playlist_archive_index(config_dir, source.sid)
+                new_ids = crawler.crawl(
+                    source.sid,
+                    f'{paged_urls[0]}/%d.html',
+                    is_archived,
+                    referer=XchinaParser.parse_referer(source.url_format),
+                    first_page=int(number) if number.isnumeric() else 1,
+                    early_stop=recent_only)
+            except (IOError, ValueError, http.client.HTTPException) as e:
+                print(f'[X] Native crawl failed, falling back to extractor: {todo_url} ({e})')
+                return False
+            for item_id in new_ids:
+                plan_item(source, source.url_format % item_id)
+            print(f'[+] Crawled: {len(new_ids)} new items <-- {todo_url}')
+            return True
+
+        # init todo queue
+        todo_failed = []
+        todo = queue.Queue()
+        for url in urls:
+            todo.put(url)
+
+        # handle every url in todo queue
+        while not todo.empty():
+            url = todo.get()
+            if url.startswith(ROOT_XCHINA):
+                url_r = url[len(ROOT_XCHINA):]
+                if url_r.startswith('model/'):
+                    model_id = XchinaParser.get_model_id(url)
+                    p_url, v_url = XchinaParser.get_model_pv_urls(model_id)
+                    todo.put(p_url)
+                    todo.put(v_url)
+                else:
+                    paged_urls = XchinaParser.extract_page_end(url)
+                    model_id, model_url = XchinaParser.get_model_id_url(url)
+                    if url_r.startswith('photos/'):
+                        todo_url = paged_urls[1] if recent_only else paged_urls[2]
+                        if not crawl_list(sources.xc_p, todo_url, paged_urls):
+                            sources.xc_p.todo_urls[todo_url] = DownloadHandler.generate_download_item(
+                                    f'{todo_url}?{PlaylistArchiveHandler.get_playlist_archive_urlparam(config_dir, sources.xc_p.sid)}'
+                                    + (f'&abcm={self.abcm}' if recent_only else '')
+                                )
+                        XchinaParser.append_url_to_list(lists, model_url, paged_urls[1])
+                        synced_lists.append(paged_urls[1])
+                    elif url_r.startswith('videos/'):
+                        todo_url = paged_urls[1] if recent_only else paged_urls[2]
+                        if not crawl_list(sources.xc_v, todo_url, paged_urls):
+                            sources.xc_v.todo_urls[todo_url] = DownloadHandler.generate_download_item(
+                                    f'{todo_url}?{PlaylistArchiveHandler.get_playlist_archive_urlparam(config_dir, sources.xc_v.sid)}'
+                                )
+                        XchinaParser.append_url_to_list(lists, model_url, paged_urls[1])
+                        synced_lists.append(paged_urls[1])
+                    elif url_r.startswith('photo/'):
+                        plan_item(sources.xc_p, paged_urls[1])
+                        XchinaParser.append_url_to_list(items, None, paged_urls[1])
+                    elif url_r.startswith('video/'):
+                        plan_item(sources.xc_v, paged_urls[1])
+                        XchinaParser.append_url_to_list(items, None, paged_urls[1])
+                    else:
+                        todo_failed.append(url)
+                        print(f'[X] Unsupported "{ROOT_XCHINA}" URL: {url}')
+            elif url.startswith(ROOT_XBBS):
+                url_r = url[len(ROOT_XBBS):]
+                paged_urls = XchinaParser.extract_page_end(url)
+                if url_r.startswith('thread/'):
+                    plan_item(sources.xbbs, paged_urls[1])
+                    XchinaParser.append_url_to_list(items, None, paged_urls[1])
+                elif url_r.startswith('forum/') or url_r.startswith('user/'):
+                    todo_url = paged_urls[1] if recent_only else paged_urls[2]
+                    if not crawl_list(sources.xbbs, todo_url, paged_urls):
+                        sources.xbbs.todo_urls[todo_url] = DownloadHandler.generate_download_item(
+                               f'{todo_url}?{PlaylistArchiveHandler.get_playlist_archive_urlparam(config_dir, sources.xbbs.sid)}'
+                            )
+                    XchinaParser.append_url_to_list(lists, None, paged_urls[1])
+                    synced_lists.append(paged_urls[1])
+                else:
+                    todo_failed.append(url)
+                    print(f'[X] Unsupported "{ROOT_XBBS}" URL: {url}')
+            else:
+                todo_failed.append(url)
+                print(f'[X] Unsupported URL: {url}')
 
-    def print_scan_ret_entry(ret, key):
-        print(f'[===] print ret.{key}:')
-        for line in ret[key]:
-            print(line)
+        print('[==] Sync finished!')
+        for index in archive_indexes.values():
+            index.close()
+        if len(satisfied) > 0:
+            print(f'[=] Skipped items already on disk: {len(satisfied)}')
+        for source in sources:
+            self.metrics.inc('xchina2_items_planned_total', {'source': source.sid},
+                             len(source.todo_urls) - planned_before[source.sid])
+        sync_ts = int(datetime.datetime.now().timestamp())
+        for list_url in synced_lists:
+            self.metrics.set('xchina2_sync_last_planned_timestamp_seconds', sync_ts, {'list': list_url})
+        self.metrics.flush()
+
+        # save URLs, merged with what other sessions saved meanwhile
+        set_lists = merge_plain_urls(lists, lists_path)
+        set_items = merge_plain_urls(items, items_path)
+        print(f'[+] Saved lists: {len(set_lists)} (+{len(set_lists) - len(LISTS_URLS)}) --> {lists_path}')
+        print(f'[+] Saved items: {len(set_items)} (+{len(set_items) - len(ITEMS_URLS)})--> {items_path}')
+
+        # what this sync added to lists/items, for tailers to skip
+        self.saved_urls.update(set(lists) - set(LISTS_URLS))
+        self.saved_urls.update(set(items) - set(ITEMS_URLS))
+        self.failed_urls.extend(todo_failed)
+        return todo_failed
 
-    def do_fix(work_dir, fix, key, source):
-        print(f'[===] fixing {key}, todo size: {len(fix[key])}')
-        file_suffix = datetime.datetime.now().strftime("%y%j-%H%M%S")
-        download_archive_path = os.path.join(ConfigHandler.getConfDir(), 'fix-downloaded.txt')
-        script_file = None
-
-        if key == 'dup_size':
-            script_file = os.path.join(ConfigHandler.getBinDir(), f'fix_dupsize_{file_suffix}.sh')
-            # update: delete image files only, leave dir there for fix-missing script to fix
-            with open(script_file, 'w') as f:
-                f.write('#!/bin/bash\n\n')
-                for todo in fix[key]:
-                    # source.todo_urls.append(source.url_format % todo['id'])
-                    f.write(f'rm -rf "{todo["img_set_path"]}"/*\n')
-                # f.write(f'rm -f "{download_archive_path}"\n')
-                f.flush()
-            # print(f'[==] Added todo urls:{len(source.todo_urls)}')
-        elif key == 'incomp_pvs':
+    def generate_bin_scripts(self,
+                            download_archive_path=None,
+                            update_pl_archive=True,
+                            script_name_prefix='run',
+                            record_failures=True):
+        return DownloadHandler.generate_bin_scripts(
+            self.work_dir,
+            self.sources,
+            download_archive_path=download_archive_path,
+            update_pl_archive=update_pl_archive,
+            script_name_prefix=script_name_prefix,
+            download_arg_common=self.download_common_arg,
+            record_failures=record_failures,
+            shards=self.shards,
+            conf_path=self.conf_dir,
+            bin_path=self.get_bin_dir(),
+            this_cmd=self.this_cmd,
+            script_jobs=self.script_jobs,
+            recent_only=self.recent_only)
+
+    def generate_batch_scripts(self, update_pl_archive=True):
+        return DownloadHandler.generate_batch_scripts(
+            self.work_dir,
+            self.sources,
+            chunks=self.batch_chunks,
+            update_pl_archive=update_pl_archive,
+            download_arg_common=self.download_common_arg,
+            conf_path=self.conf_dir,
+            bin_path=self.get_bin_dir(),
+            this_cmd=self.this_cmd,
+            recent_only=self.recent_only)
+
+    def generate_download_jobs(self):
+        return DownloadHandler.generate_download_jobs(
+            self.work_dir,
+            self.sources,
+            download_arg_common=self.download_common_arg,
+            conf_path=self.conf_dir)
+
+    def scan(self):
+        path = self.work_dir
+
+        def print_scan_ret_entry(ret, key):
+            print(f'[===] print ret.{key}:')
+            for line in ret[key]:
+                print(line)
+
+        def print_scan_fix_entry(fix, key):
+            print(f'[===] print fix.{key}:')
             for todo in fix[key]:
-                url = source.url_format % todo['id']
-                query = urllib.parse.urlencode({
-                    'force_iter': '1'
-                })
-                source.todo_urls[url] = DownloadHandler.generate_download_item(
-                        url=f'{url}?{query}',
-                        output_template=f'{todo["img_set_path"]}{source.output_template[source.output_template.rfind("/"):]}'
-                    )
-            sps = DownloadHandler.generate_bin_scripts(
-                work_dir,
-                mySource,
-                download_archive_path=download_archive_path, 
-                update_pl_archive=False,
-                script_name_prefix='fix',
-                download_arg_common=DOWNLOAD_COMMON_ARG
-            )
-            print(f'[==] Added todo urls:{len(source.todo_urls)}')
-            if os.path.exists(download_archive_path):
-                os.remove(download_archive_path)
-            # print(f'You may delete the archive file "conf/fix-downloaded.txt" before running the fix script.')
-            return sps
-        elif key == 're_locate_set' and len(fix[key]) > 0:
-            script_file = os.path.join(ConfigHandler.getBinDir(), f'fix_relocate_{file_suffix}.sh')
-            with open(script_file, 'w') as f:
-                f.write('#!/bin/bash\n\n')
-                cnt = 0
-                total = len(fix[key])
-                mkdirs = {}
-                for todo in fix[key]:
-                    cnt = cnt + 1
-                    if not todo['re_locate_path'] in mkdirs:
-                        mkdirs[todo['re_locate_path']] = True
-                        f.write(f'mkdir -p "{todo["re_locate_path"]}" \n')
-
-                    target_dir = os.path.join(todo["re_locate_path"], todo["img_set"])
-                    f.write(f'if [ ! -d "{target_dir}" ]; then\n')
-                    f.write(f'mv "{todo["img_set_path"]}" "{todo["re_locate_path"]}/" && echo "moved [{cnt}/{total}]" \n')
-                    f.write(f'else\n')
-                    f.write(f'echo "skipped [{cnt}/{total}], target exists: {target_dir}" \n')
-                    f.write(f'fi\n\n')
-                f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
-                f.write('\n\necho "DONE" \n\n')
-                f.flush()
-        elif key == 'empty_model_dir' and len(fix[key]) > 0:
-            script_file = os.path.join(ConfigHandler.getBinDir(), f'fix_emptymodel_{file_suffix}.sh')
-            with open(script_file, 'w') as f:
-                f.write('#!/bin/bash\n\n')
-                # for todo in fix[key]:
-                #     f.write(f'rm -rf "{todo}" \n')
-                f.write(f'find "{work_dir}/{source.sid}" -type f -name ".DS_Store" -delete\n\n')
-                f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
-                f.flush()
-        elif key == 'dup_id_set' and len(fix[key]) > 0:
-            script_file = os.path.join(ConfigHandler.getBinDir(), f'fix_dupid_{file_suffix}.sh')
-            with open(script_file, 'w') as f:
-                f.write('#!/bin/bash\n\n')
+                print(f'{todo["id"]} --> {todo["img_set_path"]}')
+
+        def do_fix(work_dir, fix, key, source):
+            print(f'[===] fixing {key}, todo size: {len(fix[key])}')
+            file_suffix = datetime.datetime.now().strftime("%y%j-%H%M%S")
+            download_archive_path = os.path.join(self.conf_dir, 'fix-downloaded.txt')
+            script_file = None
+
+            if key == 'dup_size':
+                script_file = os.path.join(self.get_bin_dir(), f'fix_dupsize_{file_suffix}.sh')
+                # update: delete image files only, leave dir there for fix-missing script to fix
+                with open(script_file, 'w') as f:
+                    f.write('#!/bin/bash\n\n')
+                    for todo in fix[key]:
+                        # source.todo_urls.append(source.url_format % todo['id'])
+                        f.write(f'rm -rf "{todo["img_set_path"]}"/*\n')
+                    # f.write(f'rm -f "{download_archive_path}"\n')
+                    f.flush()
+                # print(f'[==] Added todo urls:{len(source.todo_urls)}')
+            elif key == 'incomp_pvs':
                 for todo in fix[key]:
-                    f.write(f'mv -f "{todo["na"]}"/* "{todo["co"]}/" && rm -rf "{todo["na"]}" \n')
-                f.write(f'find "{work_dir}/{source.sid}" -type f -name ".DS_Store" -delete\n\n')
-                f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
-                f.flush()
+                    url = source.url_format % todo['id']
+                    query = urllib.parse.urlencode({
+                        'force_iter': '1'
+                    })
+                    source.todo_urls[url] = DownloadHandler.generate_download_item(
+                            url=f'{url}?{query}',
+                            output_template=f'{todo["img_set_path"]}{source.output_template[source.output_template.rfind("/"):]}'
+                        )
+                sps = self.generate_bin_scripts(
+                    download_archive_path=download_archive_path,
+                    update_pl_archive=False,
+                    script_name_prefix='fix',
+                    record_failures=False
+                )
+                print(f'[==] Added todo urls:{len(source.todo_urls)}')
+                if os.path.exists(download_archive_path):
+                    os.remove(download_archive_path)
+                # print(f'You may delete the archive file "conf/fix-downloaded.txt" before running the fix script.')
+                return sps
+            elif key == 're_locate_set' and len(fix[key]) > 0:
+                script_file = os.path.join(self.get_bin_dir(), f'fix_relocate_{file_suffix}.sh')
+                with open(script_file, 'w') as f:
+                    f.write('#!/bin/bash\n\n')
+                    cnt = 0
+                    total = len(fix[key])
+                    mkdirs = {}
+                    for todo in fix[key]:
+                        cnt = cnt + 1
+                        if not todo['re_locate_path'] in mkdirs:
+                            mkdirs[todo['re_locate_path']] = True
+                            f.write(f'mkdir -p "{todo["re_locate_path"]}" \n')
+
+                        target_dir = os.path.join(todo["re_locate_path"], todo["img_set"])
+                        f.write(f'if [ ! -d "{target_dir}" ]; then\n')
+                        f.write(f'mv "{todo["img_set_path"]}" "{todo["re_locate_path"]}/" && echo "moved [{cnt}/{total}]" \n')
+                        f.write(f'else\n')
+                        f.write(f'echo "skipped [{cnt}/{total}], target exists: {target_dir}" \n')
+                        f.write(f'fi\n\n')
+                    f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
+                    f.write('\n\necho "DONE" \n\n')
+                    f.flush()
+            elif key == 'empty_model_dir' and len(fix[key]) > 0:
+                script_file = os.path.join(self.get_bin_dir(), f'fix_emptymodel_{file_suffix}.sh')
+                with open(script_file, 'w') as f:
+                    f.write('#!/bin/bash\n\n')
+                    # for todo in fix[key]:
+                    #     f.write(f'rm -rf "{todo}" \n')
+                    f.write(f'find "{work_dir}/{source.sid}" -type f -name ".DS_Store" -delete\n\n')
+                    f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
+                    f.flush()
+            elif key == 'dup_id_set' and len(fix[key]) > 0:
+                script_file = os.path.join(self.get_bin_dir(), f'fix_dupid_{file_suffix}.sh')
+                with open(script_file, 'w') as f:
+                    f.write('#!/bin/bash\n\n')
+                    for todo in fix[key]:
+                        f.write(f'mv -f "{todo["na"]}"/* "{todo["co"]}/" && rm -rf "{todo["na"]}" \n')
+                    f.write(f'find "{work_dir}/{source.sid}" -type f -name ".DS_Store" -delete\n\n')
+                    f.write(f'find "{work_dir}/{source.sid}" -mindepth 1 -maxdepth 1 -type d -empty -delete\n\n')
+                    f.flush()
 
-        if script_file:
-            print(f'bash {script_file}')
-            return [script_file]
-
-    print('[===] Start scan xc_p:')
-    ret, fix = scan_photos(os.path.join(path, 'xc_p'))
-    print('[===] Comp scan xc_p:')
-    with open(os.path.join(ConfigHandler.getConfDir(), 'scan_ret_xc_p.json'), 'w') as f:
-        json.dump(ret, f)
-    with open(os.path.join(ConfigHandler.getConfDir(), 'scan_fix_xc_p.json'), 'w') as f:
-        json.dump(fix, f)
-    print(f'[===] Scan xc_p results saved to: {ConfigHandler.getConfDir()}')
-
-    print(f'Found img_sets:{len(ret["img_set_paths"])}')
-    # print_scan_ret_entry(ret, 'img_set_paths')
-    print_scan_ret_entry(ret, 'no_id_paths')
-    # print_scan_ret_entry(ret, 'no_pvs_paths')
-    # print_scan_ret_entry(ret, 'no_files_paths')
-    # print_scan_ret_entry(ret, 'unknown_files')
-    print_scan_ret_entry(ret, 'incomp_pvs')
-    print_scan_ret_entry(ret, 'dup_size')
-    print_scan_ret_entry(ret, 'dup_id_set')
-    print_scan_ret_entry(ret, 're_locate_set')
-    print_scan_ret_entry(ret, 'empty_model_dir')
-
-
-    ###
-
-    # do_fix(path, fix, 'dup_size', mySource.xc_p)
-
-    ### Stage 1, about img set self
-    sps = []
-    for key in ['dup_id_set', 're_locate_set', 'empty_model_dir']:
-        ret = do_fix(path, fix, key, mySource.xc_p)
-        if ret:
-            sps.extend(ret)
-    if len(sps) > 0:
-        print(f'[===] Generated {len(sps)} fix scripts for Stage 1.')
-        print(f'[===] Before scanning Stage 2, all fixes in Stage 1 MUST be finished.')
-        return sps
+            if script_file:
+                print(f'bash {script_file}')
+                return [script_file]
+
+        print('[===] Start scan xc_p:')
+        ret, fix, img_set_views = scan_photos(os.path.join(path, 'xc_p'))
+        # Stage 2 is judged on the tree as it will be once Stage 1 has run
+        fix['incomp_pvs'] = apply_stage1_fixes_virtually(img_set_views, fix)
+        print('[===] Comp scan xc_p:')
+        with open(os.path.join(self.conf_dir, 'scan_ret_xc_p.json'), 'w') as f:
+            json.dump(ret, f)
+        with open(os.path.join(self.conf_dir, 'scan_fix_xc_p.json'), 'w') as f:
+            json.dump(fix, f)
+        print(f'[===] Scan xc_p results saved to: {self.conf_dir}')
+        for key, value in ret.items():
+            self.metrics.set('xchina2_scan_findings', len(value), {'source': self.sources.xc_p.sid, 'kind': key})
+        self.metrics.set('xchina2_scan_last_timestamp_seconds', int(datetime.datetime.now().timestamp()), {'source': self.sources.xc_p.sid})
+        self.metrics.flush(force=True)
+
+        print(f'Found img_sets:{len(ret["img_set_paths"])}')
+        # print_scan_ret_entry(ret, 'img_set_paths')
+        print_scan_ret_entry(ret, 'no_id_paths')
+        # print_scan_ret_entry(ret, 'no_pvs_paths')
+        # print_scan_ret_entry(ret, 'no_files_paths')
+        # print_scan_ret_entry(ret, 'unknown_files')
+        # as found on disk, before Stage 1 merges and moves
+        print_scan_ret_entry(ret, 'incomp_pvs')
+        # as left by Stage 1, what Stage 2 will actually re-download
+        print_scan_fix_entry(fix, 'incomp_pvs')
+        print_scan_ret_entry(ret, 'dup_size')
+        print_scan_ret_entry(ret, 'dup_id_set')
+        print_scan_ret_entry(ret, 're_locate_set')
+        print_scan_ret_entry(ret, 'empty_model_dir')
+
+
+        ###
+
+        # do_fix(path, fix, 'dup_size', self.sources.xc_p)
+
+        ### Stage 1, about img set self
+        sps = []
+        for key in ['dup_id_set', 're_locate_set', 'empty_model_dir']:
+            ret = do_fix(path, fix, key, self.sources.xc_p)
+            if ret:
+                sps.extend(ret)
+        stage1_cnt = len(sps)
+        if stage1_cnt > 0:
+            print(f'[===] Generated {stage1_cnt} fix scripts for Stage 1.')
+
+        ### Stage 2, about media files in img set, paths as left by Stage 1
+        for key in ['incomp_pvs']:
+            ret = do_fix(path, fix, key, self.sources.xc_p)
+            if ret:
+                sps.extend(ret)
+        if len(sps) > stage1_cnt:
+            print(f'[===] Generated {len(sps) - stage1_cnt} fix scripts for Stage 2.')
+        if len(sps) > 0:
+            print(f'[===] Run the scripts in this order, Stage 1 MUST be finished before Stage 2:')
+            for sp in sps:
+                print(f'bash {sp}')
+            return sps
 
-    ### Stage 2, about media files in img set
-    for key in ['incomp_pvs']:
-        ret = do_fix(path, fix, key, mySource.xc_p)
-        if ret:
-            sps.extend(ret)
-    if len(sps) > 0:
-        print(f'[===] Generated {len(sps)} fix scripts for Stage 2.')
-        # print(f'[===] Before scanning Stage 3, all fixes in Stage 2 MUST be finished.')
+        print(f'[===] No fix scripts generated.')
         return sps
 
-    print(f'[===] No fix scripts generated.')
-    return sps
-
-def process_input_urls(work_dir, urls=[], recent_only=False):
-    print(f'[==] Processing {len(urls)} URLs:')
-
-    failed_urls = []
-    failed_urls.extend(
-        sync_urls(urls, work_dir=work_dir, recent_only=recent_only))
-
-    failed_file = ConfigHandler.getFailedFile()
-    if len(failed_urls) > 0:
-        write_plain_urls(failed_urls, failed_file)
-    print(f'[=] Failed URLs: {len(failed_urls)} --> {failed_file}')
-    
-    sps = DownloadHandler.generate_bin_scripts(work_dir, mySource, download_arg_common=DOWNLOAD_COMMON_ARG)
+    def get_archived_urls(self, sid, urls):
+        # item URLs of the source whose ids are in its download archive
+        source = getattr(self.sources, sid, None) if sid else None
+        if source is None:
+            return set()
+        wanted = {}
+        for url in urls:
+            item_id = PlaylistArchiveHandler.get_url_id(url, source.url_format)
+            if item_id:
+                wanted[item_id] = url
+        archived = set()
+        if len(wanted) > 0:
+            for line in iter_plain_urls(PlaylistArchiveHandler.get_source_archive_path(self.conf_dir, sid)):
+                cid = PlaylistArchiveHandler.parse_archive_id(line, source.extractor)
+                if cid in wanted:
+                    archived.add(wanted[cid])
+        return archived
+
+    def resolve_archived_failures(self):
+        # successes of generated scripts are not reported back, the items
+        # show up in the download archives instead
+        journal = FailureJournal(self.conf_dir)
+        urls_by_sid = {}
+        for url, entry in journal.entries().items():
+            urls_by_sid.setdefault(entry['sid'], []).append(url)
+        resolved = []
+        for sid, urls in urls_by_sid.items():
+            resolved.extend(self.get_archived_urls(sid, urls))
+        if len(resolved) > 0:
+            journal.resolve_urls(resolved)
+            print(f'[+] Resolved failures found in download archives: {len(resolved)}')
+        return resolved
+
+    def process_input_urls(self, urls=[], recent_only=False):
+        print(f'[==] Processing {len(urls)} URLs:')
+        self.recent_only = recent_only
+
+        journal = FailureJournal(self.conf_dir)
+        self.resolve_archived_failures()
+        retry_entries = journal.eligible()
+        self.retry_urls = [entry['url'] for entry in retry_entries]
+        if len(retry_entries) > 0:
+            print(f'[=] Retrying failed URLs: {len(retry_entries)}')
+
+        failed_urls = []
+        if len(urls) > 0 or len(retry_entries) <= 0:
+            failed_urls.extend(
+                self.sync_urls(urls, recent_only=recent_only))
+        # each retry re-syncs in the mode it failed in
+        for mode in [True, False]:
+            retry_urls = [entry['url'] for entry in retry_entries if entry.get('recent_only', False) == mode]
+            if len(retry_urls) > 0:
+                failed_urls.extend(self.sync_urls(retry_urls, recent_only=mode))
+
+        failed_file = ConfigHandler.getFailedFile(self.root_dir)
+        if len(failed_urls) > 0:
+            write_plain_urls(failed_urls, failed_file)
+            for url in failed_urls:
+                journal.record(None, url, FailureJournal.REASON_UNSUPPORTED, recent_only=recent_only)
+        print(f'[=] Failed URLs: {len(failed_urls)} --> {failed_file}')
+
+        if self.batch_chunks > 0:
+            sps = self.generate_batch_scripts()
+        else:
+            sps = self.generate_bin_scripts()
 
-    print(f'[==] Process Done.')
-    return sps
+        print(f'[==] Process Done.')
+        return sps
 
-def process_input_files(work_dir, input_files=[], recent_only=False):
-    print(f'[==] Processing {len(input_files)} input files:')
+    def process_input_files(self, input_files=[], recent_only=False):
+        print(f'[==] Processing {len(input_files)} input files:')
+
+        all_urls = []
+        for input_file in input_files:
+            urls = read_plain_urls(input_file)
+            print(f'[+] Got {len(urls)} URLs from file: {input_file}')
+            all_urls.extend(urls)
+
+        return self.process_input_urls(all_urls, recent_only)
+
+    def record_result(self, result):
+        # one finished download, from the python executor or a script hook
+        journal = FailureJournal(self.conf_dir)
+        metrics = self.metrics
+        labels = {'source': result.job.sid}
+        metrics.inc('xchina2_item_duration_seconds_sum', labels, result.elapsed)
+        metrics.inc('xchina2_item_duration_seconds_count', labels)
+        metrics.inc('xchina2_downloaded_bytes_total', labels, result.bytes)
+        if result.returncode == 0:
+            CostModel(self.conf_dir).record(result.job.sid, result.job.key or result.job.url, result.elapsed, result.bytes)
+            metrics.inc('xchina2_items_completed_total', labels)
+            if CostModel.url_kind(result.job.url) in CostModel.LIST_KINDS:
+                metrics.set('xchina2_sync_last_success_timestamp_seconds', int(time.time()),
+                            {'list': CostModel.list_key(result.job.url)})
+            if result.job.key is not None:
+                journal.resolve(result.job.key)
+        else:
+            reason, _ = FailureJournal.classify(result.output)
+            metrics.inc('xchina2_items_failed_total', {'source': result.job.sid, 'reason': reason})
+            if result.job.key is not None:
+                entry = journal.record_output(result.job.sid, result.job.key, result.output, recent_only=self.recent_only)
+                print(f'[X] Recorded failure: {entry["reason"]}, attempts: {entry["attempts"]}, {entry["status"]}')
+        metrics.flush()
+
+    def record_script_done(self, sid, keys, elapsed, output_file=None):
+        # success reported by a generated script: its youtube-dl stdout names
+        # the files written, a batch chunk's time and bytes are split evenly
+        files = []
+        if output_file and os.path.exists(output_file):
+            with open(output_file, 'r', encoding='utf-8', errors='replace') as f:
+                for line in f:
+                    match = DownloadExecutor.DESTINATION_PATTERN.match(line.rstrip('\n'))
+                    if match:
+                        files.append(match.group(1))
+        size = sum(os.path.getsize(file) for file in files if os.path.exists(file))
+        for key in keys:
+            job = DownloadJob(sid=sid, key=key, url=key, argv=None, host=None, update_pl_archive=False)
+            self.record_result(DownloadResult(job=job, returncode=0, output='', elapsed=float(elapsed) / len(keys),
+                                              files=files, bytes=size // len(keys)))
+        self.metrics.flush(force=True)
+
+    def create_download_executor(self, workers=None, rate=None, burst=None, keep_results=True):
+        workers = workers or self.workers
+        limiter = HostRateLimiter(self.conf_dir, rate=rate or self.rate, burst=burst or self.burst)
+        cost_model = CostModel(self.conf_dir)
+        def update_pl_archive(sid):
+            PlaylistArchiveHandler.generate_playlist_archive_files(self.conf_dir, self.sources, sid)
+        admission = None
+        estimator = None
+        if self.disk_watermark:
+            # admit downloads only while their projected size fits above the watermark
+            admission = DiskAdmission(self.work_dir, DiskAdmission.parse_watermark(self.disk_watermark))
+            catalog = self.get_catalog()
+            estimator = SizeEstimator(cost_model, catalog)
+            print(f'[=] Disk watermark: {self.disk_watermark}, est. per photo: {int(estimator.photo_bytes) >> 10}KB, per video: {int(estimator.video_bytes) >> 20}MB')
+        return DownloadExecutor(workers, limiter, update_pl_archive, self.record_result, keep_results=keep_results,
+                                admission=admission, estimate_bytes=estimator.estimate if estimator else None)
+
+    def execute_scripts(self, sps, executor=None, workers=None, rate=None, burst=None):
+        executor = executor or self.executor
+        workers = workers or self.workers
+        print(f'[===] Starting executing generated scripts: {len(sps)}')
+        # retries only count as dispatched once they really run
+        dispatched = FailureJournal(self.conf_dir).dispatch(self.retry_urls)
+        if len(dispatched) > 0:
+            print(f'[=] Dispatched failed URLs: {len(dispatched)}')
+        self.retry_urls = []
+        if executor != 'python':
+            for sp in sps:
+                print(f'[+] Script to exe: {sp}')
+                os.system(f'bash {sp}')
+            self.resolve_archived_failures()
+            print(f'[===] All scripts done!')
+            return
+
+        # consecutive download scripts share one worker pool, plain fix scripts run in order
+        results = []
+        pending_jobs = []
+        def flush_jobs():
+            if len(pending_jobs) > 0:
+                print(f'[==] Executing {len(pending_jobs)} downloads with {workers} workers')
+                results.extend(self.create_download_executor(workers, rate, burst).run(pending_jobs))
+                del pending_jobs[:]
 
-    all_urls = []
-    for input_file in input_files:
-        urls = read_plain_urls(input_file)
-        print(f'[+] Got {len(urls)} URLs from file: {input_file}')
-        all_urls.extend(urls)
-    
-    return process_input_urls(work_dir, all_urls, recent_only)
+        for sp in sps:
+            if sp in self.script_jobs:
+                print(f'[+] Jobs to exe: {len(self.script_jobs[sp])} <-- {sp}')
+                pending_jobs.extend(self.script_jobs[sp])
+            else:
+                flush_jobs()
+                print(f'[+] Script to exe: {sp}')
+                os.system(f'bash {sp}')
+        flush_jobs()
+
+        self.results.extend(results)
+        self.resolve_archived_failures()
+        failed = [r for r in results if r.returncode != 0]
+        print(f'[===] All scripts done! Downloads: {len(results)}, failed: {len(failed)}')
+
+    def export_delta(self, name='default', output_path=None):
+        print(f'[==] Exporting changes since checkpoint: {name}')
+        exporter = DeltaExporter(self.conf_dir, self.work_dir)
+        if not output_path:
+            file_suffix = datetime.datetime.now().strftime("%y%j-%H%M%S")
+            output_path = os.path.join(exporter.checkpoint_dir, f'{name}_{file_suffix}.txt')
+        files, deleted, summary = exporter.export(name, os.path.abspath(output_path))
+        for key, cnt in summary.items():
+            if cnt > 0:
+                print(f'[=] Changed - {key}: {cnt}')
+        print(f'[+] Files: {len(files)} --> {output_path}')
+        print(f'[+] Deleted: {len(deleted)} --> {output_path}.deleted.txt')
+        if not output_path.endswith(('.tar', '.tar.gz', '.tgz')):
+            print(f'[=] rsync -a --files-from="{output_path}" "{self.work_dir}/" $DEST')
+        return output_path
+
+    def watch(self, poll_interval=1.0, workers=None, rate=None, burst=None):
+        print(f'[==] Watching for new URLs')
+        dropin_dir = ConfigHandler.getDropinDir(self.root_dir)
+        dropin_done_dir = os.path.join(dropin_dir, 'done')
+        if not os.path.exists(dropin_done_dir):
+            os.makedirs(dropin_done_dir)
+
+        # only lines appended after start are new work
+        tailers = [FileTailer(ConfigHandler.getListsFile(self.root_dir)), FileTailer(ConfigHandler.getItemsFile(self.root_dir))]
+        for tailer in tailers:
+            tailer.skip_to_end()
+            print(f'[=] Tailing: {tailer.path} ({len(tailer.known)} known)')
+
+        # drop-in file --> (size, mtime) when last seen, a file is only taken
+        # once it stopped changing; writers should still write *.tmp and rename
+        dropin_sigs = {}
+        def read_dropin_urls():
+            urls = []
+            for filename in sorted(os.listdir(dropin_dir)):
+                file = os.path.join(dropin_dir, filename)
+                if filename.startswith('.') or not filename.endswith('.txt') or not os.path.isfile(file):
+                    continue
+                st = os.stat(file)
+                sig = (st.st_size, st.st_mtime_ns)
+                if dropin_sigs.get(file) != sig:
+                    dropin_sigs[file] = sig
+                    continue
+                del dropin_sigs[file]
+                file_urls = read_plain_urls(file)
+                os.replace(file, os.path.join(dropin_done_dir, filename))
+                print(f'[+] Got {len(file_urls)} URLs from drop-in file: {file}')
+                urls.extend(file_urls)
+            return urls
+
+        notifier = ChangeNotifier([self.conf_dir, dropin_dir], poll_interval)
+        executor = self.create_download_executor(workers, rate, burst, keep_results=False).start()
+        print(f'[=] Watch mode: {notifier.mode}, drop-in dir: {dropin_dir}')
+        try:
+            while True:
+                urls = read_dropin_urls()
+                for tailer in tailers:
+                    urls.extend(tailer.poll())
+                urls = [url.strip() for url in urls if len(url.strip()) > 0]
+                if len(urls) > 0:
+                    print(f'[==] New URLs: {len(urls)}')
+                    # a batch per wake-up, dropped once its jobs are queued
+                    batch = self.fork()
+                    failed_urls = batch.sync_urls(urls, recent_only=False)
+                    journal = FailureJournal(self.conf_dir)
+                    for url in failed_urls:
+                        journal.record(None, url, FailureJournal.REASON_UNSUPPORTED)
+                    # sync_urls rewrites lists/items: skip only what it wrote, lines
+                    # appended meanwhile by others are still picked up next poll
+                    for tailer in tailers:
+                        tailer.mark_known(batch.saved_urls)
+                    jobs = batch.generate_download_jobs()
+                    for job in jobs:
+                        executor.submit(job)
+                    print(f'[=] Submitted downloads: {len(jobs)}, in queue: {executor.pending()}')
+                self.metrics.flush()
+                notifier.wait()
+        except KeyboardInterrupt:
+            print(f'[X] Stopping watch, cancelling queued downloads: {executor.pending()}')
+            executor.cancel()
+            raise
+        finally:
+            notifier.close()
+            self.metrics.flush(force=True)
 
 def real_main(argv):
     print('=====XCHINA2=====')
-    global THIS_CMD
-    THIS_CMD = ' '.join(argv)
-    global DOWNLOAD_COMMON_ARG
-    global ABCM
 
     conf_dir = os.path.abspath(os.environ.get('XCHINA2_CONF_DIR', './'))
     work_dir = os.path.abspath(os.environ.get('XCHINA2_DATA_DIR', './'))
@@ -805,6 +1499,17 @@ def real_main(argv):
     youtube_dl_config = os.environ.get('XCHINA_YOUTUBE_DL_CONFIG', None)
     proxy_setting = os.environ.get('XCHINA2_PROXY_SETTING', None)
     abcm = os.environ.get('XCHINA2_ABCM', '5')
+    executor = os.environ.get('XCHINA2_EXECUTOR', 'bash').lower()
+    workers = int(os.environ.get('XCHINA2_WORKERS', '1'))
+    rate = float(os.environ.get('XCHINA2_RATE', '1'))
+    burst = int(os.environ.get('XCHINA2_BURST', '3'))
+    sleep_interval = os.environ.get('XCHINA2_SLEEP_INTERVAL', None)
+    metrics_port = os.environ.get('XCHINA2_METRICS_PORT', None)
+    batch_chunks = int(os.environ.get('XCHINA2_BATCH_CHUNKS', '0'))
+    use_catalog = os.environ.get('XCHINA2_CATALOG', '1').lower() in ['1', 'true', 'yes']
+    shards = int(os.environ.get('XCHINA2_SHARDS', '1'))
+    native_crawl = int(os.environ.get('XCHINA2_NATIVE_CRAWL', '0'))
+    disk_watermark = os.environ.get('XCHINA2_DISK_WATERMARK', None)
 
     if exe_scripts:
         if exe_scripts == '1' or exe_scripts.lower() == 'true' or exe_scripts.lower() == 'yes':
@@ -820,75 +1525,169 @@ def real_main(argv):
     print(f'[=] youtube-dl_config: {youtube_dl_config}')
     print(f'[=] proxy_setting: {proxy_setting}')
     print(f'[=] abcm: {abcm}')
-
-    if conf_dir:
-        ConfigHandler.setRootDir(conf_dir)
-
+    # the rate limiter only spaces youtube-dl process starts; spacing the
+    # downloads inside one process is opt-in, it slows down every photo set
+    if sleep_interval is not None:
+        sleep_interval = float(sleep_interval) if float(sleep_interval) > 0 else None
+    elif 'XCHINA2_RATE' in os.environ:
+        concurrency = batch_chunks if batch_chunks > 0 else (workers if executor == 'python' else 1)
+        sleep_interval = HostRateLimiter.sleep_interval(rate, concurrency)
+    print(f'[=] executor: {executor}, workers: {workers}, rate: {rate}/s, burst: {burst}, sleep_interval: {sleep_interval}')
+    print(f'[=] batch_chunks: {batch_chunks}, shards: {shards}')
+    print(f'[=] catalog: {"True" if use_catalog else "False"}, native_crawl: {native_crawl}')
+    print(f'[=] disk_watermark: {disk_watermark}')
+
+    download_common_arg = ''
     if youtube_dl_config:
-        DOWNLOAD_COMMON_ARG = DOWNLOAD_COMMON_ARG + f' --config-location {youtube_dl_config}'
+        download_common_arg = download_common_arg + f' --config-location {youtube_dl_config}'
 
     if proxy_setting:
-        DOWNLOAD_COMMON_ARG = DOWNLOAD_COMMON_ARG + f' --proxy {proxy_setting}'
-
-    if abcm:
-        ABCM = int(abcm)
+        download_common_arg = download_common_arg + f' --proxy {proxy_setting}'
+
+    if sleep_interval:
+        download_common_arg = download_common_arg + f' --sleep-interval {sleep_interval:g}'
+
+    session = XchinaSession(
+        root_dir=conf_dir,
+        work_dir=work_dir,
+        this_cmd=' '.join(argv),
+        download_common_arg=download_common_arg,
+        abcm=int(abcm) if abcm else 5,
+        batch_chunks=batch_chunks,
+        use_catalog=use_catalog,
+        shards=shards,
+        native_crawl=native_crawl,
+        executor=executor,
+        workers=workers,
+        rate=rate,
+        burst=burst,
+        disk_watermark=disk_watermark)
+
+    # short helper commands run from inside generated scripts, which inherit the port
+    short_cmds = ['help', 'version', 'playlist', 'done', 'batch-done', 'failure', 'batch-failure', 'export-delta', 'test']
+    if metrics_port and (len(argv) <= 1 or argv[1].strip().lower() not in short_cmds):
+        try:
+            session.metrics.serve(int(metrics_port))
+        except OSError as ose:
+            print(f'[X] Metrics not served, port {metrics_port}: {ose}')
 
     sps = None
     if len(argv) > 1:
         arg = argv[1].strip()
         print(f'[===] Cmd arg: {arg}')
         if arg == 'help':
-            print(f'xchina2 [ $URL | urls.txt | playlist | full | photo | scan | version | help ]')
+            print(f'xchina2 [ $URL | urls.txt | playlist | full | photo | scan | retry | watch | export-delta [name] [output] | version | help ]')
             exit()
         elif arg == 'version':
             print(f'20230909') ### VERSION HERE ###
         elif arg.startswith("http"):
             print(f'[=] Start with input URL: {arg}')
-            sps = process_input_urls(work_dir, [arg])
+            sps = session.process_input_urls([arg])
         elif arg.endswith('.txt'):
             print(f'[=] Start with input file: {arg}')
-            sps = process_input_files(work_dir, [arg])
+            sps = session.process_input_files([arg])
         elif arg.lower() == 'playlist':
             sid = argv[2].strip() if len(argv) > 2 else None
-            PlaylistArchiveHandler.generate_playlist_archive_files(ConfigHandler.getConfDir(), mySource, sid)
+            PlaylistArchiveHandler.generate_playlist_archive_files(session.conf_dir, session.sources, sid)
             print(f'[=] Done.')
             exit()
         elif arg.lower() == 'full':
-            print(f'[=] Start updating fully with default input files: {ConfigHandler.getListsFile()}')
+            print(f'[=] Start updating fully with default input files: {ConfigHandler.getListsFile(session.root_dir)}')
             RECENT_ONLY = False # found full sets 
             print(f'[=] Param: recent_only={RECENT_ONLY}')
-            PlaylistArchiveHandler.generate_playlist_archive_files(ConfigHandler.getConfDir(), mySource)
-            sps = process_input_files(work_dir, [ConfigHandler.getListsFile()], recent_only=RECENT_ONLY)
+            PlaylistArchiveHandler.generate_playlist_archive_files(session.conf_dir, session.sources)
+            sps = session.process_input_files([ConfigHandler.getListsFile(session.root_dir)], recent_only=RECENT_ONLY)
         elif arg.lower() == 'photo':
             urls = ['https://xchina.co/photos/kind-1.html', 'https://xchina.co/photos/kind-2.html']
             print(f'[=] Start with default URL: {urls}')
-            sps = process_input_urls(work_dir, urls, recent_only=True)
+            sps = session.process_input_urls(urls, recent_only=True)
         elif arg.lower() == 'scan':
-            sps = scan(work_dir)
+            sps = session.scan()
+        elif arg.lower() == 'watch':
+            session.watch()
+            exit()
+        elif arg.lower() == 'export-delta':
+            name = argv[2].strip() if len(argv) > 2 else 'default'
+            output_path = argv[3].strip() if len(argv) > 3 else None
+            session.export_delta(name, output_path)
+            exit()
+        elif arg.lower() == 'retry':
+            print(f'[=] Start retrying eligible failed URLs')
+            sps = session.process_input_urls([], recent_only=False)
+            for key, cnt in FailureJournal(session.conf_dir).summary().items():
+                print(f'[=] Failures left - {key}: {cnt}')
+        elif arg.lower() == 'done':
+            # called by generated scripts: xchina2 done $SID $URL $SECONDS $STDOUT_FILE
+            sid, url, elapsed = argv[2].strip(), argv[3].strip(), float(argv[4])
+            session.record_script_done(sid, [url], elapsed, argv[5] if len(argv) > 5 else None)
+            exit()
+        elif arg.lower() == 'batch-done':
+            # called by batch scripts: xchina2 batch-done $SID $KEYS_FILE $SECONDS $STDOUT_FILE
+            sid, keys_file, elapsed = argv[2].strip(), argv[3].strip(), float(argv[4])
+            keys = read_plain_urls(keys_file)
+            if len(keys) > 0:
+                session.record_script_done(sid, keys, elapsed, argv[5] if len(argv) > 5 else None)
+            exit()
+        elif arg.lower() == 'failure':
+            # called by generated scripts: xchina2 failure $SID $URL $STDERR_FILE [$RECENT_ONLY]
+            sid, url = argv[2].strip(), argv[3].strip()
+            output = ''
+            if len(argv) > 4 and os.path.exists(argv[4]):
+                with open(argv[4], 'r', encoding='utf-8', errors='replace') as f:
+                    output = f.read()
+            recent_only = argv[5].strip() == '1' if len(argv) > 5 else None
+            entry = FailureJournal(session.conf_dir).record_output(sid, url, output, recent_only=recent_only)
+            print(f'[X] Recorded failure: {entry["reason"]}, attempts: {entry["attempts"]}, {entry["status"]} --> {url}')
+            session.metrics.inc('xchina2_items_failed_total', {'source': sid, 'reason': entry['reason']})
+            session.metrics.flush(force=True)
+            exit()
+        elif arg.lower() == 'batch-failure':
+            # called by batch scripts: xchina2 batch-failure $SID $KEYS_FILE $STDERR_FILE [$RECENT_ONLY]
+            # youtube-dl ignores errors per item, items not archived after the chunk have failed
+            sid, keys_file = argv[2].strip(), argv[3].strip()
+            output = ''
+            if len(argv) > 4 and os.path.exists(argv[4]):
+                with open(argv[4], 'r', encoding='utf-8', errors='replace') as f:
+                    output = f.read()
+            recent_only = argv[5].strip() == '1' if len(argv) > 5 else None
+            keys = read_plain_urls(keys_file)
+            # list pages never show up in the archive, their fate in a failed
+            # chunk is unknown: not blamed here, a dispatched retry expires
+            url_format = getattr(session.sources, sid).url_format
+            item_keys = [key for key in keys if PlaylistArchiveHandler.get_url_id(key, url_format)]
+            archived = session.get_archived_urls(sid, item_keys)
+            journal = FailureJournal(session.conf_dir)
+            failed = 0
+            for key in item_keys:
+                if key in archived:
+                    journal.resolve(key)
+                    continue
+                entry = journal.record_output(sid, key, output, recent_only=recent_only)
+                session.metrics.inc('xchina2_items_failed_total', {'source': sid, 'reason': entry['reason']})
+                failed += 1
+            print(f'[X] Recorded batch failures: {failed} of {len(item_keys)} items, '
+                  f'{len(keys) - len(item_keys)} lists not blamed --> {keys_file}')
+            session.metrics.flush(force=True)
+            exit()
         elif arg.lower() == 'test':
             print(f'[=] Start TEST')
-            print(f'Conf.0: {ConfigHandler.getConfDir()}')
-            # ConfigHandler.setRootDir('/Users/toumasakichi/Downloads/tmp')
-            print(f'Conf.1: {ConfigHandler.getConfDir()}')
-            print(f'Bin.1: {ConfigHandler.getBinDir()}')
+            print(f'Conf.1: {session.conf_dir}')
+            print(f'Bin.1: {session.get_bin_dir()}')
         else:
             print(f'[X] Unsupported input arg, exit..')
             exit()
     else:
-        print(f'[==] No arg found, using default input files: {ConfigHandler.getListsFile()}')
+        print(f'[==] No arg found, using default input files: {ConfigHandler.getListsFile(session.root_dir)}')
         ### IMP, TODO, switch mode
         RECENT_ONLY = True #found recent set only
         print(f'[=] Param: recent_only={RECENT_ONLY}')
-        PlaylistArchiveHandler.generate_playlist_archive_files(ConfigHandler.getConfDir(), mySource)
-        sps = process_input_files(work_dir, [ConfigHandler.getListsFile()], recent_only=RECENT_ONLY)
+        PlaylistArchiveHandler.generate_playlist_archive_files(session.conf_dir, session.sources)
+        sps = session.process_input_files([ConfigHandler.getListsFile(session.root_dir)], recent_only=RECENT_ONLY)
         #process_input_files(recent_only=False)#try to force re-sync every set & image
     
     if sps and exe_scripts:
-        print(f'[===] Starting executing generated scripts: {len(sps)}')
-        for sp in sps:
-            print(f'[+] Script to exe: {sp}')
-            os.system(f'bash {sp}')
-        print(f'[===] All scripts done!')
+        session.execute_scripts(sps)
+    session.metrics.flush(force=True)
 
 if __name__ == '__main__':
     real_main(sys.argv)